@@ -0,0 +1,64 @@
+# -*- encoding: UTF-8 -*-
+"""Canny thresholds picked from the frame's median brightness, cached per lighting bucket."""
+
+import threading
+
+import numpy as np
+
+DEFAULT_THRESHOLDS = (50, 150)
+
+
+def grid_median(gray, step=8):
+    """Median intensity over every step-th pixel in both directions."""
+    return float(np.median(gray[::step, ::step]))
+
+
+class AdaptiveCanny(object):
+    """Maps frame brightness to (low, high) Canny thresholds.
+
+    The median of a subsampled grid puts the frame in a lighting bucket of
+    bucket_size gray levels. Each bucket's thresholds are computed once,
+    from the bucket centre, as (1 - sigma) and (1 + sigma) times the
+    median, so small flicker inside a bucket never changes the edge count
+    verdict.
+    """
+
+    def __init__(self, sigma=0.33, bucket_size=16, step=8, min_low=10):
+        self.sigma = sigma
+        self.bucket_size = bucket_size
+        self.step = step
+        self.min_low = min_low
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.last_bucket = None
+
+    def _compute(self, bucket):
+        median = (bucket + 0.5) * self.bucket_size
+        low = max(self.min_low, int((1.0 - self.sigma) * median))
+        high = min(255, max(low + 1, int((1.0 + self.sigma) * median)))
+        return low, high
+
+    def thresholds(self, gray):
+        bucket = int(grid_median(gray, self.step)) // self.bucket_size
+        with self._lock:
+            self.last_bucket = bucket
+            thresholds = self._buckets.get(bucket)
+            if thresholds is not None:
+                self.hits += 1
+                return thresholds
+            self.misses += 1
+            thresholds = self._compute(bucket)
+            self._buckets[bucket] = thresholds
+            return thresholds
+
+    def format_stats(self):
+        lookups = self.hits + self.misses
+        buckets = ", ".join("{}: {}/{}".format(bucket * self.bucket_size, low, high)
+                            for bucket, (low, high) in sorted(self._buckets.items()))
+        return "Adaptive Canny: {} frames, {} lighting buckets ({}), {:.0%} cached".format(
+            lookups, len(self._buckets), buckets, float(self.hits) / lookups if lookups else 0.0)
+
+
+adaptive_canny = AdaptiveCanny()
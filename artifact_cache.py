@@ -0,0 +1,126 @@
+# -*- encoding: UTF-8 -*-
+"""Per-frame cache of gray, blurred, edge and Hough results shared by detectors."""
+
+import collections
+import threading
+
+import cv2
+import numpy as np
+
+from frame_decoder import luma
+
+
+class FrameArtifacts(object):
+    """Lazily computed derivatives of one frame.
+
+    The gray image is copied out of the source frame on creation, because
+    grabber slots and pooled buffers are reused; everything else is derived
+    from that copy the first time a consumer asks for it. With a mask (a
+    RegionOfInterest mask of the same size) edges outside it are dropped.
+    """
+
+    def __init__(self, image, cache=None, mask=None):
+        gray = luma(image)
+        if gray is None:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = np.array(gray, copy=True, order="C")
+        self._cache = cache
+        self._mask = mask
+        self._items = {"gray": gray}
+        self.nbytes = gray.nbytes
+        self._lock = threading.Lock()
+
+    def _get(self, key, compute):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                return value
+        value = compute()
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = value
+                size = value.nbytes if value is not None else 0
+                self.nbytes += size
+                if self._cache is not None:
+                    self._cache._grew(size)
+            return self._items[key]
+
+    def gray(self):
+        return self._items["gray"]
+
+    def blurred(self, ksize=(5, 5)):
+        return self._get(("blurred", ksize), lambda: cv2.GaussianBlur(self.gray(), ksize, 0))
+
+    def edges(self, low=50, high=150, blur=True):
+        """Canny edges of the blurred image (detect_edges) or the raw gray one (Hough path)."""
+        source = self.blurred if blur else self.gray
+
+        def compute():
+            edges = cv2.Canny(source(), low, high)
+            if self._mask is not None:
+                cv2.bitwise_and(edges, self._mask, dst=edges)
+            return edges
+        return self._get(("edges", low, high, blur), compute)
+
+    def lines(self, threshold=50, min_line_length=0, max_line_gap=0, low=50, high=150):
+        key = ("lines", threshold, min_line_length, max_line_gap, low, high)
+
+        def compute():
+            lines = cv2.HoughLinesP(self.edges(low, high, blur=False), 1, np.pi / 180,
+                                    threshold=threshold, minLineLength=min_line_length,
+                                    maxLineGap=max_line_gap)
+            return lines if lines is not None else np.zeros((0, 1, 4), dtype=np.int32)
+        lines = self._get(key, compute)
+        return lines if len(lines) else None
+
+
+class ArtifactCache(object):
+    """LRU map of (camera, timestamp, size) -> FrameArtifacts bounded by bytes."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, image, camera, timestamp, mask=None):
+        """FrameArtifacts of a frame; camera names the source (and ROI, if masked)."""
+        key = (camera, timestamp, image.shape[:2])
+        with self._lock:
+            artifacts = self._entries.pop(key, None)
+            if artifacts is not None:
+                self.hits += 1
+                self._entries[key] = artifacts
+                return artifacts
+            self.misses += 1
+            artifacts = FrameArtifacts(image, self, mask)
+            self._entries[key] = artifacts
+            self._grew(artifacts.nbytes)
+            return artifacts
+
+    def _grew(self, size):
+        with self._lock:
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, oldest = self._entries.popitem(last=False)
+                oldest._cache = None
+                self.total_bytes -= oldest.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def format_stats(self):
+        lookups = self.hits + self.misses
+        return ("Artifact cache: {} frames, {:.1f} MB, {} hits / {} lookups ({:.0%}), {} evicted").format(
+            len(self._entries), self.total_bytes / 1e6, self.hits, lookups,
+            float(self.hits) / lookups if lookups else 0.0, self.evictions)
+
+
+artifact_cache = ArtifactCache()
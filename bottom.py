@@ -1,20 +1,30 @@
 import sys
 import time
-import cv2
-import numpy as np
 from naoqi import ALProxy, ALBroker, ALModule
-import os
-from datetime import datetime
+from camera_session import CameraSession, BOTTOM_CAMERA, kVGA, kYuvColorSpace
+from frame_grabber import FrameGrabber
+from sonar_fusion import SonarFusion
+from sonar_sampler import SonarSampler
+from vision_workers import VisionWorkerPool
+from coarse_to_fine import CoarseToFineCheck
+from image_writer import AsyncImageWriter, DROP_OLDEST
+from frame_archive import FrameArchive
+from change_gate import ChangeGate, Undecided
+from undistort import calibrated
 
 NAO_IP = "localhost"
 SonarHandler = None
 memory = None
 cameraProxy = None
+vision_pool = None
 
-# Crear un directorio para guardar las imágenes, si no existe
+# Archivo rotativo de imágenes: como máximo 256 MB en bloques de 16 MB
 image_directory = "saved_images"
-if not os.path.exists(image_directory):
-    os.makedirs(image_directory)
+image_archive = FrameArchive(image_directory, byte_budget=256 * 1024 * 1024,
+                             chunk_bytes=16 * 1024 * 1024, fmt="png")
+
+# Las imágenes se codifican y escriben en segundo plano
+image_writer = AsyncImageWriter(max_queue=8, drop_policy=DROP_OLDEST)
 
 class SonarHandlerModule(ALModule):
     def __init__(self, name):
@@ -26,15 +36,29 @@ class SonarHandlerModule(ALModule):
             memory = ALProxy("ALMemory")
             global cameraProxy
             cameraProxy = ALProxy("ALVideoDevice")
+            self.camera = CameraSession(cameraProxy, "SonarHandlerBottom", BOTTOM_CAMERA, kVGA, kYuvColorSpace, 5)
+            self.grabber = FrameGrabber(self.camera)
+            self.grabber.start()
 
             sonarProxy = ALProxy("ALSonar")
             sonarProxy.subscribe("SonarApp")
+            # Los sonares se leen en segundo plano; parar con la última muestra, girar con la mediana
+            self.sonar = SonarSampler(memory, fusion=SonarFusion())
+            self.sonar.start()
             print("Sonar and camera activated. Reading values...")
 
             self.safe_distance = 0.5
             self.is_moving_forward = False
             self.is_turning = False
             self.turning_direction = 'left' 
+            self.last_frame = None
+            self.change_gate = ChangeGate()
+            # Hough a 1/4 de resolución; VGA solo cerca del límite.
+            # Sin corregir la distorsión hasta que haya calibración del robot
+            undistort_camera = BOTTOM_CAMERA if calibrated(BOTTOM_CAMERA) else None
+            self.hough_check = CoarseToFineCheck(max_lines=4, level=2, pool=vision_pool, threshold=50,
+                                                 undistort=undistort_camera, roi=BOTTOM_CAMERA,
+                                                 adaptive_canny=True)
 
             self.subscribe_to_events()
             self.start_moving_forward()
@@ -100,7 +124,7 @@ class SonarHandlerModule(ALModule):
     def onSonarRightDetected(self, *_args):
         print("Obstacle detected by right sonar.")
         try:
-            distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
+            distance = self.sonar.current()[1]
             print("Right sonar detected an object at distance: {}".format(distance))
             if distance < self.safe_distance:
                 self.stop_moving_forward()
@@ -112,7 +136,7 @@ class SonarHandlerModule(ALModule):
     def onSonarLeftDetected(self, *_args):
         print("Obstacle detected by left sonar.")
         try:
-            distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
+            distance = self.sonar.current()[0]
             print("Left sonar detected an object at distance: {}".format(distance))
             if distance < self.safe_distance:
                 self.stop_moving_forward()
@@ -135,34 +159,28 @@ class SonarHandlerModule(ALModule):
 
     def process_image(self):
         try:
-            resolution = 2
-            colorSpace = 13
-            video = cameraProxy.getImageRemote(cameraProxy.subscribe("CameraBottom", resolution, colorSpace, 5))
+            frame = self.grabber.latest()
+            self.last_frame = frame
 
-            if video is None:
+            if frame is None:
                 return False
 
-            image = np.frombuffer(video[6], dtype=np.uint8)
-            image = image.reshape((video[1], video[0], 3))
-            gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            edges = cv2.Canny(gray_image, 50, 150)
-            lines = cv2.HoughLinesP(edges, 1, np.pi / 180, 50)
-
-            # Guardar la imagen procesada
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            image_filename = os.path.join(image_directory, f"image_{timestamp}.png")
-            cv2.imwrite(image_filename, image)  # Guardar imagen original
-            print(f"Image saved as {image_filename}")
-
-            return lines is None or len(lines) <= 4
+            return self.change_gate.check(frame.image, lambda: self.detect_clear(frame))
         except Exception as e:
             print("Error processing image: {}".format(e))
             return False
 
+    def detect_clear(self, frame):
+        check = self.hough_check.check(frame.image, "bottom", frame.timestamp)
+        # sin ninguna decisión todavía: el camino cuenta como bloqueado
+        clear = check is not None and check.clear
+        # una decisión repetida no se guarda en la puerta de cambios
+        return clear if self.hough_check.fresh else Undecided(clear)
+
     def is_clear_path(self):
         try:
-            right_distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
-            left_distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
+            left_distance, right_distance = self.sonar.current()
+            echoes = self.sonar.fusion.profile()
             camera_clear = self.process_image()
 
             path_clear = (
@@ -171,9 +189,15 @@ class SonarHandlerModule(ALModule):
                 and camera_clear
             )
 
-            print("Right distance: {}, Left distance: {}, Camera clear: {}".format(
-                right_distance, left_distance, camera_clear))
+            print("Right distance: {}, Left distance: {}, Echoes L/C/R: {:.2f}/{:.2f}/{:.2f}, Camera clear: {}".format(
+                right_distance, left_distance, echoes.left, echoes.center, echoes.right, camera_clear))
             print("Path clear status: {}".format(path_clear))
+
+            # Guardar la imagen original junto con la decisión
+            if self.last_frame is not None:
+                image_writer.archive(image_archive, self.last_frame.image, self.last_frame.timestamp,
+                                     camera=BOTTOM_CAMERA, sonar_left=left_distance,
+                                     sonar_right=right_distance, clear=path_clear)
             return path_clear
         except Exception as e:
             print("Error checking clear path: {}".format(e))
@@ -182,6 +206,9 @@ class SonarHandlerModule(ALModule):
 
 def main():
     try:
+        # Los procesos de visión se crean antes del broker de NAOqi
+        global vision_pool
+        vision_pool = VisionWorkerPool()
         myBroker = ALBroker("myBroker", "0.0.0.0", 0, NAO_IP, 9559)
         global SonarHandler
         SonarHandler = SonarHandlerModule("SonarHandler")
@@ -192,6 +219,21 @@ def main():
         print("Keyboard Interruption")
         if SonarHandler:
             SonarHandler.stop_moving_forward()
+            SonarHandler.grabber.stop()
+            print(SonarHandler.grabber.format_stats())
+            print(SonarHandler.camera.format_stats())
+            SonarHandler.camera.close()
+            image_writer.stop()
+            print(image_writer.format_stats())
+            image_archive.close()
+            print(image_archive.format_stats())
+            print(SonarHandler.change_gate.format_stats())
+            print(SonarHandler.hough_check.format_stats())
+            SonarHandler.sonar.stop()
+            print(SonarHandler.sonar.format_stats())
+            print(SonarHandler.sonar.fusion.format_stats())
+            vision_pool.close()
+            print(vision_pool.format_stats())
         sys.exit(0)
     except Exception as e:
         print("Error in main: {}".format(e))
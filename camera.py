@@ -1,6 +1,8 @@
+import sys
 import cv2
-import numpy as np
 from naoqi import ALProxy
+from frame_decoder import decode
+from frame_recorder import FrameRecorder
 
 ip = "10.42.0.134"
 port = 9559
@@ -11,14 +13,15 @@ color_space = 11
 fps = 30
 name_id = video_proxy.subscribe("python_client", resolution, color_space, fps)
 
+# python camera.py pasillo.frames graba los frames para reproducirlos sin robot
+recorder = FrameRecorder(sys.argv[1]) if len(sys.argv) > 1 else None
+
 try:
     while True:
         image_container = video_proxy.getImageRemote(name_id)
-        image_width = image_container[0]
-        image_height = image_container[1]
-        raw_image = image_container[6]
-
-        image_array = np.frombuffer(raw_image, dtype=np.uint8).reshape((image_height, image_width, 3))
+        if recorder is not None:
+            recorder.record(image_container)
+        image_array = decode(image_container, 3)
 
         cv2.imshow("NAO Camera Feed", image_array)
 
@@ -26,4 +29,7 @@ try:
             break
 finally:
     video_proxy.unsubscribe(name_id)
-    cv2.destroyAllWindows()
\ No newline at end of file
+    cv2.destroyAllWindows()
+    if recorder is not None:
+        recorder.close()
+        print("Recorded {} frames to {}".format(recorder.frames, recorder.path))
\ No newline at end of file
@@ -0,0 +1,265 @@
+# -*- encoding: UTF-8 -*-
+"""Long-lived ALVideoDevice subscriptions shared by the vision scripts."""
+
+import threading
+import time
+
+import numpy as np
+
+from frame_decoder import decode
+
+TOP_CAMERA = 0
+BOTTOM_CAMERA = 1
+
+# Resoluciones de ALVideoDevice
+kQQVGA = 0  # 160x120
+kQVGA = 1   # 320x240
+kVGA = 2    # 640x480
+k4VGA = 3   # 1280x960
+
+# Espacios de color de ALVideoDevice
+kYuvColorSpace = 0
+kYUV422ColorSpace = 9
+kRGBColorSpace = 11
+kBGRColorSpace = 13
+
+RESOLUTION_SIZES = {
+    kQQVGA: (160, 120),
+    kQVGA: (320, 240),
+    kVGA: (640, 480),
+    k4VGA: (1280, 960),
+}
+
+# Bytes por pixel de cada espacio de color
+COLOR_SPACE_LAYERS = {
+    kYuvColorSpace: 1,
+    kYUV422ColorSpace: 2,
+    kRGBColorSpace: 3,
+    kBGRColorSpace: 3,
+}
+
+
+def frame_shape(resolution, color_space):
+    """Returns the numpy shape of a frame as (height, width, layers)."""
+    width, height = RESOLUTION_SIZES[resolution]
+    return (height, width, COLOR_SPACE_LAYERS[color_space])
+
+
+def container_timestamp(container):
+    """Capture time reported by ALVideoDevice, in seconds."""
+    return container[4] + container[5] * 1e-6
+
+
+class LatencyStats(object):
+    """Capture latency counters shared by the camera sessions."""
+
+    def reset_stats(self):
+        self.frames = 0
+        self.failures = 0
+        self.last_latency = 0.0
+        self.total_latency = 0.0
+        self.min_latency = None
+        self.max_latency = 0.0
+
+    def _record_latency(self, elapsed):
+        self.frames += 1
+        self.last_latency = elapsed
+        self.total_latency += elapsed
+        if self.min_latency is None or elapsed < self.min_latency:
+            self.min_latency = elapsed
+        if elapsed > self.max_latency:
+            self.max_latency = elapsed
+
+    def stats(self):
+        mean = self.total_latency / self.frames if self.frames else 0.0
+        return {
+            "frames": self.frames,
+            "failures": self.failures,
+            "last_ms": self.last_latency * 1000.0,
+            "mean_ms": mean * 1000.0,
+            "min_ms": (self.min_latency or 0.0) * 1000.0,
+            "max_ms": self.max_latency * 1000.0,
+        }
+
+    def format_stats(self):
+        return ("{name}: {frames} frames, {failures} failures, "
+                "latency last {last_ms:.1f} ms / mean {mean_ms:.1f} ms / "
+                "min {min_ms:.1f} ms / max {max_ms:.1f} ms").format(name=self.name, **self.stats())
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+        return False
+
+
+class CameraSession(LatencyStats):
+    """Subscribes to one camera once and reuses the handle for every frame.
+
+    The handle is released by close(), so scripts no longer leak one
+    ALVideoDevice subscriber per captured frame.
+    """
+
+    def __init__(self, video_proxy, name, camera=BOTTOM_CAMERA, resolution=kVGA,
+                 color_space=kBGRColorSpace, fps=30):
+        self.video_proxy = video_proxy
+        self.name = name
+        self.camera = camera
+        self.resolution = resolution
+        self.color_space = color_space
+        self.fps = fps
+        self.handle = None
+        self.recorder = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def open(self):
+        with self._lock:
+            if self.handle is None:
+                self.handle = self.video_proxy.subscribeCamera(
+                    self.name, self.camera, self.resolution, self.color_space, self.fps)
+        return self.handle
+
+    def close(self):
+        with self._lock:
+            if self.handle is not None:
+                try:
+                    self.video_proxy.unsubscribe(self.handle)
+                finally:
+                    self.handle = None
+
+    def get_image(self):
+        """Returns the getImageRemote container, or None if no frame came back."""
+        if self.handle is None:
+            self.open()
+        with self._lock:
+            start = time.time()
+            container = self.video_proxy.getImageRemote(self.handle)
+            elapsed = time.time() - start
+        if container is None or container[0] is None:
+            self.failures += 1
+            return None
+        self._record_latency(elapsed)
+        if self.recorder is not None:
+            self.recorder.record(container, self.camera)
+        return container
+
+    def read_into(self, out):
+        """Copies the next frame into out and returns its capture time."""
+        container = self.get_image()
+        if container is None:
+            return None
+        np.copyto(out, decode(container, out.shape[-1]))
+        return container_timestamp(container)
+
+    def shape(self):
+        return frame_shape(self.resolution, self.color_space)
+
+
+class DualCameraSession(LatencyStats):
+    """Captures the top and bottom cameras together as one time-aligned pair.
+
+    Uses ALVideoDevice.subscribeCameras/getImagesRemote so both frames come
+    back in a single round-trip. On NAOqi versions without multi-camera
+    subscriptions it falls back to two CameraSessions fetched in parallel,
+    which still costs one round-trip of latency instead of two.
+    """
+
+    def __init__(self, video_proxy, name, resolution=kVGA, color_space=kBGRColorSpace, fps=30):
+        self.video_proxy = video_proxy
+        self.name = name
+        self.resolution = resolution
+        self.color_space = color_space
+        self.fps = fps
+        self.handle = None
+        self.sessions = None
+        self.recorder = None
+        self.last_skew = 0.0
+        self.max_skew = 0.0
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def open(self):
+        with self._lock:
+            if self.handle is not None or self.sessions is not None:
+                return
+            try:
+                self.handle = self.video_proxy.subscribeCameras(
+                    self.name, [TOP_CAMERA, BOTTOM_CAMERA],
+                    [self.resolution, self.resolution],
+                    [self.color_space, self.color_space], self.fps)
+            except Exception as e:
+                print("subscribeCameras not available ({}), fetching both cameras in parallel.".format(e))
+                self.sessions = [
+                    CameraSession(self.video_proxy, self.name + "Top", TOP_CAMERA,
+                                  self.resolution, self.color_space, self.fps),
+                    CameraSession(self.video_proxy, self.name + "Bottom", BOTTOM_CAMERA,
+                                  self.resolution, self.color_space, self.fps),
+                ]
+                for session in self.sessions:
+                    session.open()
+
+    def close(self):
+        with self._lock:
+            if self.handle is not None:
+                try:
+                    self.video_proxy.unsubscribe(self.handle)
+                finally:
+                    self.handle = None
+            if self.sessions is not None:
+                for session in self.sessions:
+                    session.close()
+                self.sessions = None
+
+    def _fetch_parallel(self):
+        results = [None, None]
+
+        def fetch(index):
+            results[index] = self.sessions[index].get_image()
+
+        worker = threading.Thread(target=fetch, args=(0,))
+        worker.start()
+        fetch(1)
+        worker.join()
+        return results
+
+    def get_images(self):
+        """Returns the (top, bottom) containers, or None if either is missing."""
+        if self.handle is None and self.sessions is None:
+            self.open()
+        start = time.time()
+        if self.handle is not None:
+            with self._lock:
+                containers = self.video_proxy.getImagesRemote(self.handle)
+        else:
+            containers = self._fetch_parallel()
+        elapsed = time.time() - start
+        if (not containers or len(containers) < 2
+                or any(c is None or c[0] is None for c in containers)):
+            self.failures += 1
+            return None
+        self._record_latency(elapsed)
+        self.last_skew = abs(container_timestamp(containers[0]) - container_timestamp(containers[1]))
+        self.max_skew = max(self.max_skew, self.last_skew)
+        if self.recorder is not None:
+            self.recorder.record(containers[0], TOP_CAMERA)
+            self.recorder.record(containers[1], BOTTOM_CAMERA)
+        return containers[0], containers[1]
+
+    def read_into(self, out):
+        """Copies both frames into out[0] (top) and out[1] (bottom)."""
+        pair = self.get_images()
+        if pair is None:
+            return None
+        for index, container in enumerate(pair):
+            np.copyto(out[index], decode(container, out.shape[-1]))
+        return min(container_timestamp(pair[0]), container_timestamp(pair[1]))
+
+    def shape(self):
+        return (2,) + frame_shape(self.resolution, self.color_space)
+
+    def format_stats(self):
+        return "{}, pair skew last {:.1f} ms / max {:.1f} ms".format(
+            LatencyStats.format_stats(self), self.last_skew * 1000.0, self.max_skew * 1000.0)
@@ -0,0 +1,125 @@
+# -*- encoding: UTF-8 -*-
+"""Skips the full vision check when the scene has not changed since the last one."""
+
+import time
+
+import cv2
+import numpy as np
+
+from frame_decoder import BufferPool, luma
+
+
+class Undecided(object):
+    """What compute() returns when it could not decide on this frame.
+
+    The gate hands fallback (usually the previous decision) to the caller
+    but neither caches it nor moves its reference to this frame.
+    """
+
+    def __init__(self, fallback=None):
+        self.fallback = fallback
+
+
+def decided(decision):
+    """decision itself, or its fallback if it is Undecided (for callers without a gate)."""
+    return decision.fallback if isinstance(decision, Undecided) else decision
+
+
+class ChangeGate(object):
+    """Compares a tiny subsampled copy of each frame with the previous one.
+
+    The copy takes every n-th pixel of the luma plane, so its cost does not
+    depend on the frame size (the gate runs on the caller's thread).
+
+    If the mean absolute difference is below threshold (gray levels), the
+    previous decision is returned instead of running compute() again. At
+    most max_reuse decisions in a row and none older than max_age seconds
+    are reused, so a slow drift still triggers a fresh check.
+    """
+
+    def __init__(self, threshold=4.0, size=(32, 24), max_reuse=10, max_age=2.0):
+        self.threshold = threshold
+        self.size = size
+        self.max_reuse = max_reuse
+        self.max_age = max_age
+        self.pool = BufferPool()
+        self._previous = None
+        self._decision = None
+        self._decided_at = 0.0
+        self._reused = 0
+        self.hits = 0
+        self.misses = 0
+        self.undecided = 0
+        self.compute_time = 0.0
+        self.gate_time = 0.0
+        self.last_difference = None
+
+    def _signature(self, image):
+        frames = image if image.ndim == 4 else [image]
+        width, height = self.size
+        out = self.pool.get("signature", (len(frames), height, width))
+        for index, frame in enumerate(frames):
+            step_y = max(1, frame.shape[0] // height)
+            step_x = max(1, frame.shape[1] // width)
+            small = frame[step_y // 2::step_y, step_x // 2::step_x][:height, :width]
+            gray = luma(small)
+            if gray is None:
+                gray = cv2.cvtColor(np.ascontiguousarray(small), cv2.COLOR_BGR2GRAY)
+            np.copyto(out[index], gray)
+        return out
+
+    def check(self, image, compute):
+        """Returns compute()'s decision, or the previous one if the scene is unchanged.
+
+        An Undecided result is unwrapped and returned without being cached.
+        """
+        start = time.time()
+        signature = self._signature(image)
+        reusable = (self._previous is not None
+                    and self._previous.shape == signature.shape
+                    and self._reused < self.max_reuse
+                    and start - self._decided_at < self.max_age)
+        if reusable:
+            diff = self.pool.get("diff", signature.shape)
+            cv2.absdiff(signature, self._previous, dst=diff)
+            self.last_difference = float(diff.mean())
+        self.gate_time += time.time() - start
+
+        if reusable and self.last_difference < self.threshold:
+            self.hits += 1
+            self._reused += 1
+            return self._decision
+
+        self.misses += 1
+        compute_start = time.time()
+        decision = compute()
+        self.compute_time += time.time() - compute_start
+        if isinstance(decision, Undecided):
+            self.undecided += 1
+            return decision.fallback
+        self._decision = decision
+        self._decided_at = time.time()
+        self._reused = 0
+        if self._previous is None or self._previous.shape != signature.shape:
+            self._previous = np.empty_like(signature)
+        np.copyto(self._previous, signature)
+        return self._decision
+
+    def reset(self):
+        self._previous = None
+
+    def stats(self):
+        checks = self.hits + self.misses
+        mean_compute = self.compute_time / self.misses if self.misses else 0.0
+        return {
+            "checks": checks,
+            "hits": self.hits,
+            "hit_rate": float(self.hits) / checks if checks else 0.0,
+            "undecided": self.undecided,
+            "saved_ms": (self.hits * mean_compute - self.gate_time) * 1000.0,
+            "gate_ms": self.gate_time / checks * 1000.0 if checks else 0.0,
+        }
+
+    def format_stats(self):
+        return ("Change gate: {checks} checks, {hits} reused ({hit_rate:.0%}), "
+                "{undecided} undecided not cached, {saved_ms:.0f} ms of CPU saved, {gate_ms:.2f} ms gate cost per check").format(**self.stats())
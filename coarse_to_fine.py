@@ -0,0 +1,95 @@
+# -*- encoding: UTF-8 -*-
+"""Hough obstacle check on a downscaled pyramid level, full resolution only when unsure."""
+
+import collections
+import time
+
+from vision_workers import run_vision_job
+
+CoarseCheck = collections.namedtuple("CoarseCheck", ["clear", "lines", "limit", "sectors", "escalated"])
+
+
+class CoarseToFineCheck(object):
+    """Runs the "hough" vision job on pyramid level first.
+
+    The downscale happens inside the job, so with a worker pool the
+    caller only copies the frame into a slot.
+
+    Hough threshold, min_line_length and max_line_gap are lengths in
+    pixels, so they are divided by the level's scale. A frame is clear when
+    it has at most max_lines segments, with or without an ROI: segment
+    counts do not shrink in proportion to the cropped area. If the
+    coarse count is within margin * limit (at least min_band lines) of the
+    limit, the check is repeated on the full frame. A frame the worker
+    pool drops or does not answer in time is undecided and check()
+    returns the previous CoarseCheck instead; fresh tells whether the
+    last check() decided on its own frame.
+    """
+
+    def __init__(self, max_lines=4, level=2, margin=0.5, min_band=1.0, pool=None, **params):
+        self.max_lines = max_lines
+        self.level = level
+        self.margin = margin
+        self.min_band = min_band
+        self.pool = pool
+        self.params = params
+        scale = float(2 ** level)
+        self.coarse_params = dict(params, level=level)
+        for name in ("threshold", "min_line_length", "max_line_gap"):
+            if name in params:
+                self.coarse_params[name] = max(1, int(round(params[name] / scale)))
+        self.last_check = None
+        self.fresh = False
+        self.checks = 0
+        self.escalations = 0
+        self.undecided = 0
+        self.coarse_time = 0.0
+        self.full_time = 0.0
+
+    def _run(self, image, tag, timestamp, params):
+        result = run_vision_job(self.pool, image, "hough", tag, timestamp, **params)
+        if result is None:
+            return None
+        return result, self.max_lines
+
+    def check(self, image, tag, timestamp):
+        """Returns a CoarseCheck, or None if undecided before any decision was made."""
+        self.checks += 1
+        self.fresh = False
+        start = time.time()
+        outcome = self._run(image, tag, timestamp, self.coarse_params)
+        self.coarse_time += time.time() - start
+        if outcome is None:
+            self.undecided += 1
+            return self.last_check
+        result, limit = outcome
+        escalated = False
+        if abs(result["lines"] - limit) <= max(self.margin * limit, self.min_band):
+            start = time.time()
+            outcome = self._run(image, tag, timestamp, self.params)
+            self.full_time += time.time() - start
+            if outcome is None:
+                self.undecided += 1
+                return self.last_check
+            result, limit = outcome
+            escalated = True
+            self.escalations += 1
+        self.last_check = CoarseCheck(result["lines"] <= limit, result["lines"], limit, result["sectors"],
+                                      escalated)
+        self.fresh = True
+        return self.last_check
+
+    def stats(self):
+        checks = self.checks or 1
+        return {
+            "checks": self.checks,
+            "escalations": self.escalations,
+            "escalation_rate": float(self.escalations) / checks,
+            "undecided": self.undecided,
+            "coarse_ms": self.coarse_time / checks * 1000.0,
+            "full_ms": self.full_time / (self.escalations or 1) * 1000.0,
+        }
+
+    def format_stats(self):
+        return ("Coarse-to-fine check: {checks} checks, {escalations} escalated to full resolution "
+                "({escalation_rate:.0%}), {undecided} undecided, coarse {coarse_ms:.1f} ms, full {full_ms:.1f} ms").format(**self.stats())
@@ -3,10 +3,13 @@ import time
 import cv2
 import numpy as np
 from naoqi import ALProxy, ALBroker, ALModule
+from memory_mirror import MemoryMirror
+from sensor_snapshot import SONAR_LEFT, SONAR_RIGHT
 
 NAO_IP = "localhost"
 SonarHandler = None
 memory = None
+mirror = None
 cameraProxy = None
 
 class SonarHandlerModule(ALModule):
@@ -17,6 +20,9 @@ class SonarHandlerModule(ALModule):
             self.motion = ALProxy("ALMotion")
             global memory
             memory = ALProxy("ALMemory")
+            # Copia local de las distancias, actualizada por los eventos del sonar
+            global mirror
+            mirror = MemoryMirror(memory)
             global cameraProxy
             cameraProxy = ALProxy("ALVideoDevice")
 
@@ -42,9 +48,15 @@ class SonarHandlerModule(ALModule):
         try:
             memory.subscribeToEvent("SonarLeftDetected", "SonarHandler", "onSonarLeftDetected")
             memory.subscribeToEvent("SonarRightDetected", "SonarHandler", "onSonarRightDetected")
+            # Los "Nothing" marcan la copia como caducada: la siguiente lectura va a ALMemory
+            mirror.subscribe("SonarHandler", "onMirrorEvent",
+                             ["SonarLeftNothingDetected", "SonarRightNothingDetected"])
         except Exception as e:
             print("Error subscribing to events: {}".format(e))
 
+    def onMirrorEvent(self, key, value, _message):
+        mirror.on_event(key, value)
+
     def initialize_head_position(self):
         try:
             print("Initializing head position...")
@@ -92,10 +104,11 @@ class SonarHandlerModule(ALModule):
         except Exception as e:
             print("Error turning: {}".format(e))
 
-    def onSonarRightDetected(self, *_args):
+    def onSonarRightDetected(self, event, value, _subscriber):
         print("Obstacle detected by right sonar.")
+        mirror.on_event(event, value)
         try:
-            distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
+            distance = mirror.get(SONAR_RIGHT)
             print("Right sonar detected an object at distance: {}".format(distance))
             if distance < self.safe_distance:
                 self.stop_moving_forward()
@@ -104,10 +117,11 @@ class SonarHandlerModule(ALModule):
         except Exception as e:
             print("Error handling right sonar detection: {}".format(e))
 
-    def onSonarLeftDetected(self, *_args):
+    def onSonarLeftDetected(self, event, value, _subscriber):
         print("Obstacle detected by left sonar.")
+        mirror.on_event(event, value)
         try:
-            distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
+            distance = mirror.get(SONAR_LEFT)
             print("Left sonar detected an object at distance: {}".format(distance))
             if distance < self.safe_distance:
                 self.stop_moving_forward()
@@ -150,8 +164,7 @@ class SonarHandlerModule(ALModule):
 
     def is_clear_path(self):
         try:
-            right_distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
-            left_distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
+            right_distance, left_distance = mirror.get_many([SONAR_RIGHT, SONAR_LEFT])
             camera_clear = self.process_image()
 
             path_clear = (
@@ -181,6 +194,8 @@ def main():
         print("Keyboard Interruption")
         if SonarHandler:
             SonarHandler.stop_moving_forward()
+            mirror.unsubscribe()
+            print(mirror.format_stats())
         sys.exit(0)
     except Exception as e:
         print("Error in main: {}".format(e))
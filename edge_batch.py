@@ -0,0 +1,114 @@
+# -*- encoding: UTF-8 -*-
+"""Edge maps and per-region edge densities over N x H x W frame stacks.
+
+Usage: python edge_batch.py pasillo.frames [camera]
+"""
+
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from frame_decoder import BufferPool, decode, luma
+from frame_recorder import ReplayVideoDevice
+from resolution_controller import VGA_EDGE_THRESHOLD, normalized_edge_count
+
+batch_pool = BufferPool()
+
+
+def load_stack(path, camera=None):
+    """Reads every frame of one camera from a recording into an N x H x W luma stack."""
+    video_proxy = ReplayVideoDevice(path)
+    if camera is None:
+        camera = video_proxy.cameras()[0]
+    handle = video_proxy.subscribeCamera("batch", camera, 0, 0, 0)
+    frames = []
+    while True:
+        container = video_proxy.getImageRemote(handle)
+        if container is None:
+            break
+        image = decode(container)
+        y_plane = luma(image)
+        frames.append(y_plane if y_plane is not None else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+    return np.stack(frames) if frames else np.zeros((0, 0, 0), dtype=np.uint8)
+
+
+def edge_maps(stack, low=50, high=150, pool=batch_pool):
+    """GaussianBlur + Canny of every frame, written into one pooled N x H x W array.
+
+    Same chain as detect_edges. The per-frame calls run in OpenCV's C code,
+    so the Python loop only costs a few microseconds per frame.
+    """
+    blurred = pool.get("batch_blurred", stack.shape[1:])
+    edges = pool.get("batch_edges", stack.shape)
+    for index in range(len(stack)):
+        cv2.GaussianBlur(stack[index], (5, 5), 0, dst=blurred)
+        cv2.Canny(blurred, low, high, edges=edges[index])
+    return edges
+
+
+def region_densities(edges, grid=(3, 3), pool=batch_pool):
+    """Fraction of edge pixels in each grid cell, as an N x rows x cols array.
+
+    Rows and columns that do not fill a whole cell are ignored.
+    """
+    count, height, width = edges.shape
+    rows, cols = grid
+    cell_h, cell_w = height // rows, width // cols
+    cells = edges[:, :rows * cell_h, :cols * cell_w].reshape(count, rows, cell_h, cols, cell_w)
+    sums = pool.get("batch_sums", (count, rows, cols), np.uint32)
+    np.sum(cells > 0, axis=(2, 4), dtype=np.uint32, out=sums)
+    densities = pool.get("batch_densities", (count, rows, cols), np.float32)
+    np.divide(sums, float(cell_h * cell_w), out=densities)
+    return densities
+
+
+def vga_edge_counts(edges):
+    """detect_edges counts for the whole stack, scaled to VGA-equivalent values."""
+    counts = np.count_nonzero(edges.reshape(len(edges), -1), axis=1)
+    return normalized_edge_count(counts, edges.shape[2])
+
+
+def sweep_thresholds(scores, thresholds, labels=None):
+    """Evaluates every threshold against every score in one broadcast.
+
+    Returns the fraction of frames flagged as obstacle per threshold and,
+    when labels (True = obstacle) are given, the accuracy per threshold.
+    """
+    flagged = np.asarray(scores)[None, :] > np.asarray(thresholds)[:, None]
+    rate = flagged.mean(axis=1)
+    if labels is None:
+        return rate, None
+    accuracy = (flagged == np.asarray(labels, dtype=bool)[None, :]).mean(axis=1)
+    return rate, accuracy
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    camera = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    stack = load_stack(sys.argv[1], camera)
+    if not len(stack):
+        print("No frames in {}".format(sys.argv[1]))
+        return
+
+    start = time.time()
+    edges = edge_maps(stack)
+    densities = region_densities(edges)
+    scores = vga_edge_counts(edges)
+    elapsed = time.time() - start
+    print("{} frames of {}x{} in {:.2f} s ({:.2f} ms/frame)".format(
+        len(stack), stack.shape[2], stack.shape[1], elapsed, elapsed / len(stack) * 1000.0))
+    print("Mean edge density per region:")
+    print(np.array2string(densities.mean(axis=0), precision=4))
+
+    thresholds = VGA_EDGE_THRESHOLD * np.array([0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0])
+    rate, _ = sweep_thresholds(scores, thresholds)
+    for threshold, flagged in zip(thresholds, rate):
+        print("threshold {:7.0f}: {:5.1%} of frames flagged as obstacle".format(threshold, flagged))
+
+
+if __name__ == "__main__":
+    main()
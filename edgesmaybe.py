@@ -1,14 +1,9 @@
-import cv2
-import numpy as np
 from naoqi import ALProxy
 import time
-
-def detect_edges(image):
-    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred_image = cv2.GaussianBlur(gray_image, (5, 5), 0)
-    edges = cv2.Canny(blurred_image, 50, 150)
-    edge_count = cv2.countNonZero(edges)
-    return edges, edge_count
+from camera_session import DualCameraSession, kVGA, kYuvColorSpace
+from frame_decoder import decode
+from vision_checks import detect_edges
+from image_writer import AsyncImageWriter, DROP_OLDEST
 
 def main():
     robot_ip = "localhost"
@@ -19,46 +14,46 @@ def main():
         print "No se pudo conectar al NAO en {0}:{1}. Error: {2}".format(robot_ip, port, e)
         return
 
-    resolution = 2  
-    color_space = 13
+    resolution = kVGA
+    color_space = kYuvColorSpace
     fps = 30
 
-    client_top = video_proxy.subscribeCamera("TopCamera", 0, resolution, color_space, fps)
-    client_bottom = video_proxy.subscribeCamera("BottomCamera", 1, resolution, color_space, fps) 
+    cameras = DualCameraSession(video_proxy, "EdgeCameras", resolution, color_space, fps)
+    cameras.open()
+    image_writer = AsyncImageWriter(max_queue=4, drop_policy=DROP_OLDEST, fmt="jpeg", jpeg_quality=80)
 
     try:
         while True:
-            top_result = video_proxy.getImageRemote(client_top)
-            if top_result[0] is not None:
-                top_image = bytearray(top_result[6])
-                top_image = np.frombuffer(top_image, np.uint8).reshape((top_result[1], top_result[0], 3))
-                edges, edge_count = detect_edges(top_image)
+            pair = cameras.get_images()
+            if pair is not None:
+                top_result, bottom_result = pair
+                top_image = decode(top_result)
+                edges, edge_count = detect_edges(top_image, "top")
                 print "Camara superior: Bordes detectados = {0}".format(edge_count)
                 if edge_count > 1000: 
                     print "Objeto detectado en la cámara superior."
                 else:
                     print "No se detectó objeto en la cámara superior."
-                cv2.imwrite("edges_top.jpg", edges) 
+                image_writer.save("edges_top.jpg", edges)
 
-            bottom_result = video_proxy.getImageRemote(client_bottom)
-            if bottom_result[0] is not None:
-                bottom_image = bytearray(bottom_result[6])
-                bottom_image = np.frombuffer(bottom_image, np.uint8).reshape((bottom_result[1], bottom_result[0], 3))
-                edges, edge_count = detect_edges(bottom_image)
+                bottom_image = decode(bottom_result)
+                edges, edge_count = detect_edges(bottom_image, "bottom")
                 print "Camara inferior: Bordes detectados = {0}".format(edge_count)
                 if edge_count > 1000:  # Ajusta este umbral según tus pruebas
                     print "Objeto detectado en la cámara inferior."
                 else:
                     print "No se detectó objeto en la cámara inferior."
-                cv2.imwrite("edges_bottom.jpg", edges)  # Guardar imagen de bordes para ver los resultados
+                image_writer.save("edges_bottom.jpg", edges)  # Guardar imagen de bordes para ver los resultados
 
             time.sleep(1)
 
     except KeyboardInterrupt:
         print "Interrupción manual del programa."
     finally:
-        video_proxy.unsubscribe(client_top)
-        video_proxy.unsubscribe(client_bottom)
+        print cameras.format_stats()
+        cameras.close()
+        image_writer.stop()
+        print image_writer.format_stats()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,194 @@
+# -*- encoding: UTF-8 -*-
+"""Rolling on-disk frame archive bounded by a byte budget."""
+
+import bisect
+import collections
+import os
+import re
+import struct
+import threading
+
+import cv2
+import numpy as np
+
+from image_writer import RAW_HEADER, encode
+
+FORMATS = ["png", "jpeg", "raw"]
+
+# timestamp, camera, sonar izq., sonar der., despejado (-1 desconocido),
+# offset, longitud, formato
+INDEX_RECORD = struct.Struct("<dBffbIIB")
+
+CHUNK_NAME = re.compile(r"^chunk_(\d+)\.(bin|idx)$")
+
+ArchiveEntry = collections.namedtuple(
+    "ArchiveEntry",
+    ["timestamp", "camera", "sonar_left", "sonar_right", "clear", "chunk", "offset", "length", "fmt"])
+
+
+def decode_bytes(data, fmt):
+    if fmt == "raw":
+        height, width, layers = RAW_HEADER.unpack_from(data)
+        image = np.frombuffer(data, dtype=np.uint8, offset=RAW_HEADER.size)
+        return image.reshape((height, width, layers))
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+class FrameArchive(object):
+    """Stores frames in large append-only chunk files with a binary index.
+
+    Every chunk_<n>.bin has a chunk_<n>.idx next to it holding one
+    INDEX_RECORD per frame. The index of all chunks is kept in memory, so
+    query() finds a time range by bisection without touching the directory.
+    When the archive grows past byte_budget the oldest chunk is deleted.
+    A .bin without its .idx (or the reverse) cannot be read back, so it is
+    deleted on load; new chunks are numbered after every file found.
+    Timestamps are expected to be appended in non-decreasing order.
+    """
+
+    def __init__(self, directory, byte_budget=512 * 1024 * 1024, chunk_bytes=16 * 1024 * 1024,
+                 fmt="jpeg", jpeg_quality=90):
+        self.directory = directory
+        self.byte_budget = byte_budget
+        self.chunk_bytes = chunk_bytes
+        self.fmt = fmt
+        self.jpeg_quality = jpeg_quality
+        self._lock = threading.Lock()
+        self._entries = []
+        self._times = []
+        self._chunks = collections.OrderedDict()  # chunk -> bytes used
+        self._current = None
+        self._data_file = None
+        self._index_file = None
+        self._next_chunk = 0
+        self.evicted_chunks = 0
+        self.orphans_removed = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def _path(self, chunk, ext):
+        return os.path.join(self.directory, "chunk_{:08d}.{}".format(chunk, ext))
+
+    def _load(self):
+        files = collections.defaultdict(set)
+        for match in (CHUNK_NAME.match(name) for name in os.listdir(self.directory)):
+            if match:
+                files[int(match.group(1))].add(match.group(2))
+        if files:
+            self._next_chunk = max(files) + 1
+        for chunk in sorted(files):
+            if files[chunk] != set(("bin", "idx")):
+                # sin su pareja no se puede leer: se borra para no mezclar datos
+                for ext in files[chunk]:
+                    os.remove(self._path(chunk, ext))
+                self.orphans_removed += 1
+                continue
+            index_path = self._path(chunk, "idx")
+            data_size = os.path.getsize(self._path(chunk, "bin"))
+            with open(index_path, "rb") as f:
+                raw = f.read()
+            for pos in range(0, len(raw) - INDEX_RECORD.size + 1, INDEX_RECORD.size):
+                ts, camera, left, right, clear, offset, length, fmt = INDEX_RECORD.unpack_from(raw, pos)
+                if offset + length > data_size:
+                    break  # frame cortado por un apagado a mitad de escritura
+                self._add_entry(ArchiveEntry(ts, camera, left, right,
+                                             None if clear < 0 else bool(clear),
+                                             chunk, offset, length, FORMATS[fmt]))
+            self._chunks[chunk] = data_size + len(raw)
+
+    def _add_entry(self, entry):
+        self._entries.append(entry)
+        self._times.append(entry.timestamp)
+
+    def _open_chunk(self):
+        self._close_files()
+        self._current = self._next_chunk
+        self._next_chunk += 1
+        self._chunks[self._current] = 0
+        self._data_file = open(self._path(self._current, "bin"), "ab")
+        self._index_file = open(self._path(self._current, "idx"), "ab")
+
+    def _close_files(self):
+        for f in (self._data_file, self._index_file):
+            if f is not None:
+                f.close()
+        self._data_file = self._index_file = None
+
+    def _evict(self):
+        while sum(self._chunks.values()) > self.byte_budget and len(self._chunks) > 1:
+            chunk = next(iter(self._chunks))
+            if chunk == self._current:
+                break
+            del self._chunks[chunk]
+            count = 0
+            while count < len(self._entries) and self._entries[count].chunk == chunk:
+                count += 1
+            del self._entries[:count]
+            del self._times[:count]
+            for ext in ("bin", "idx"):
+                try:
+                    os.remove(self._path(chunk, ext))
+                except OSError:
+                    pass
+            self.evicted_chunks += 1
+
+    def append(self, image, timestamp, camera=0, sonar_left=float("nan"), sonar_right=float("nan"),
+               clear=None, fmt=None):
+        fmt = fmt or self.fmt
+        return self.append_encoded(encode(image, fmt, self.jpeg_quality), fmt, timestamp,
+                                   camera, sonar_left, sonar_right, clear)
+
+    def append_encoded(self, data, fmt, timestamp, camera=0, sonar_left=float("nan"),
+                       sonar_right=float("nan"), clear=None):
+        with self._lock:
+            if (self._current is None
+                    or self._chunks[self._current] + len(data) > self.chunk_bytes):
+                self._open_chunk()
+            offset = self._data_file.tell()
+            self._data_file.write(data)
+            self._data_file.flush()
+            clear_code = -1 if clear is None else int(bool(clear))
+            self._index_file.write(INDEX_RECORD.pack(timestamp, camera, sonar_left, sonar_right,
+                                                     clear_code, offset, len(data), FORMATS.index(fmt)))
+            self._index_file.flush()
+            entry = ArchiveEntry(timestamp, camera, sonar_left, sonar_right, clear,
+                                 self._current, offset, len(data), fmt)
+            self._add_entry(entry)
+            self._chunks[self._current] += len(data) + INDEX_RECORD.size
+            self._evict()
+            return entry
+
+    def query(self, start, end, camera=None):
+        """Entries with start <= timestamp <= end, oldest first."""
+        with self._lock:
+            first = bisect.bisect_left(self._times, start)
+            last = bisect.bisect_right(self._times, end)
+            entries = self._entries[first:last]
+        if camera is not None:
+            entries = [e for e in entries if e.camera == camera]
+        return entries
+
+    def read(self, entry):
+        with open(self._path(entry.chunk, "bin"), "rb") as f:
+            f.seek(entry.offset)
+            data = f.read(entry.length)
+        return decode_bytes(data, entry.fmt)
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(self._chunks.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        with self._lock:
+            self._close_files()
+            self._current = None
+
+    def format_stats(self):
+        return ("Frame archive {}: {} frames in {} chunks, {:.1f} MB of {:.1f} MB, {} chunks evicted, "
+                "{} orphan chunks removed").format(
+                    self.directory, len(self), len(self._chunks), self.total_bytes() / 1e6,
+                    self.byte_budget / 1e6, self.evicted_chunks, self.orphans_removed)
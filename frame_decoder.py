@@ -0,0 +1,85 @@
+# -*- encoding: UTF-8 -*-
+"""Copy-free decoding of getImageRemote containers and pooled intermediates."""
+
+import cv2
+import numpy as np
+
+
+class BufferPool(object):
+    """Hands out the same preallocated array for a given role and shape."""
+
+    def __init__(self):
+        self._buffers = {}
+        self.allocations = 0
+        self.allocated_bytes = 0
+
+    def get(self, role, shape, dtype=np.uint8):
+        key = (role, tuple(shape), np.dtype(dtype).str)
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[key] = buf
+            self.allocations += 1
+            self.allocated_bytes += buf.nbytes
+        return buf
+
+    def clear(self):
+        self._buffers.clear()
+
+
+def decode(container, layers=None):
+    """Wraps the payload of a getImageRemote container as an (H, W, layers) view.
+
+    np.frombuffer shares memory with the payload, so unlike the old
+    bytearray(...) round-trip nothing is copied. The view is read-only.
+    """
+    width, height = container[0], container[1]
+    if layers is None:
+        layers = container[2]
+    image = np.frombuffer(container[6], dtype=np.uint8)
+    return image.reshape((height, width, layers))
+
+
+def luma(image):
+    """Y plane of a frame captured in kYuvColorSpace or kYUV422ColorSpace.
+
+    kYuvColorSpace frames have one layer, so the plane is contiguous.
+    kYUV422ColorSpace frames are Y0 U Y1 V byte pairs decoded as (H, W, 2),
+    and the plane is the strided view of layer 0. Returns None for frames
+    that carry color instead of luma.
+    """
+    if image.ndim == 2:
+        return image
+    if image.shape[2] in (1, 2):
+        return image[:, :, 0]
+    return None
+
+
+class FrameDecoder(object):
+    """Runs the gray / blur / Canny chain into pooled buffers.
+
+    Buffers are keyed by tag (usually the camera name) and resolution. A
+    result stays valid until the next frame of the same tag and size is
+    processed.
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else BufferPool()
+
+    def gray(self, image, tag="frame"):
+        y_plane = luma(image)
+        if y_plane is not None:
+            return y_plane
+        out = self.pool.get((tag, "gray"), image.shape[:2])
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=out)
+
+    def blur(self, gray, tag="frame", ksize=(5, 5)):
+        out = self.pool.get((tag, "blurred"), gray.shape)
+        return cv2.GaussianBlur(gray, ksize, 0, dst=out)
+
+    def edges(self, gray, tag="frame", low=50, high=150):
+        out = self.pool.get((tag, "edges"), gray.shape)
+        return cv2.Canny(gray, low, high, edges=out)
+
+
+default_decoder = FrameDecoder()
@@ -0,0 +1,144 @@
+# -*- encoding: UTF-8 -*-
+"""Background capture thread that keeps the newest frames in a numpy ring."""
+
+import collections
+import threading
+import time
+
+import numpy as np
+
+Frame = collections.namedtuple("Frame", ["image", "timestamp", "received", "seq"])
+
+
+class FrameGrabber(object):
+    """Pulls frames from an open camera session into preallocated buffers.
+
+    Works with CameraSession and DualCameraSession; with the latter every
+    slot holds a (top, bottom) pair.
+
+    latest() hands out a view of the newest slot without any RPC. The slot
+    stays leased to the caller until the next call to latest(), so the
+    grabber thread never overwrites a frame that is still being processed.
+
+    The thread polls at the session's fps: after a new frame it sleeps
+    until the next one is due, and a frame whose capture timestamp was
+    already seen is neither published nor counted.
+    """
+
+    def __init__(self, session, slots=4, idle_sleep=0.005):
+        if slots < 3:
+            raise ValueError("FrameGrabber needs at least 3 slots")
+        self.session = session
+        self.idle_sleep = idle_sleep
+        self.buffers = np.zeros((slots,) + session.shape(), dtype=np.uint8)
+        self.timestamps = np.zeros(slots)
+        self.received = np.zeros(slots)
+        self.seqs = np.zeros(slots, dtype=np.int64)
+        self._lock = threading.Lock()
+        self._latest = None
+        self._leased = None
+        self._consumed = True
+        self._thread = None
+        self._running = False
+        self.captured = 0
+        self.dropped = 0
+        self.errors = 0
+        self.repeated = 0
+
+    def start(self):
+        if self._thread is None:
+            self.session.open()
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="FrameGrabber-" + self.session.name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def _next_slot(self):
+        slots = len(self.buffers)
+        start = 0 if self._latest is None else self._latest + 1
+        for offset in range(slots):
+            index = (start + offset) % slots
+            if index != self._latest and index != self._leased:
+                return index
+
+    def _run(self):
+        fps = getattr(self.session, "fps", None)
+        period = 1.0 / fps if fps else 0.0
+        next_time = time.time()
+        last_timestamp = None
+        while self._running:
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                index = self._next_slot()
+            try:
+                timestamp = self.session.read_into(self.buffers[index])
+            except Exception as e:
+                self.errors += 1
+                print("Error capturing frame: {}".format(e))
+                time.sleep(0.1)
+                continue
+            if timestamp is None or timestamp == last_timestamp:
+                # el siguiente frame aun no ha llegado: se vuelve a mirar enseguida
+                if timestamp is not None:
+                    self.repeated += 1
+                next_time = time.time() + self.idle_sleep
+                continue
+            last_timestamp = timestamp
+            next_time = max(next_time + period, time.time())
+
+            with self._lock:
+                self.captured += 1
+                if not self._consumed:
+                    self.dropped += 1
+                self.timestamps[index] = timestamp
+                self.received[index] = time.time()
+                self.seqs[index] = self.captured
+                self._latest = index
+                self._consumed = False
+
+    def latest(self):
+        """Returns the newest Frame, or None if nothing was captured yet."""
+        with self._lock:
+            index = self._latest
+            if index is None:
+                return None
+            self._leased = index
+            self._consumed = True
+            return Frame(self.buffers[index], self.timestamps[index],
+                         self.received[index], int(self.seqs[index]))
+
+    def wait_for_frame(self, timeout=1.0):
+        deadline = time.time() + timeout
+        while self._latest is None and time.time() < deadline:
+            time.sleep(self.idle_sleep)
+        return self.latest()
+
+    def age(self):
+        """Seconds since the newest frame arrived on this machine."""
+        with self._lock:
+            if self._latest is None:
+                return None
+            return time.time() - self.received[self._latest]
+
+    def stats(self):
+        return {
+            "captured": self.captured,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "repeated": self.repeated,
+            "drop_rate": float(self.dropped) / self.captured if self.captured else 0.0,
+            "age_ms": (self.age() or 0.0) * 1000.0,
+        }
+
+    def format_stats(self):
+        return ("{name}: {captured} frames grabbed, {dropped} dropped ({drop_rate:.0%}), "
+                "{repeated} repeated reads skipped, {errors} errors, newest frame {age_ms:.1f} ms old").format(
+                    name=self.session.name, **self.stats())
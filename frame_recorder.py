@@ -0,0 +1,171 @@
+# -*- encoding: UTF-8 -*-
+"""Records getImageRemote containers to a memory-mapped file and replays them.
+
+ReplayVideoDevice answers the ALVideoDevice calls used by the scripts, so
+CameraSession, DualCameraSession and FrameGrabber run on a recording
+exactly as they do on the robot.
+"""
+
+import mmap
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b"NAOFRM01"
+# ancho, alto, capas, espacio de color, segundos, microsegundos, camara, bytes
+RECORD_HEADER = struct.Struct("<IIIIIIII")
+
+
+class FrameRecorder(object):
+    """Appends containers to a preallocated, memory-mapped recording file."""
+
+    def __init__(self, path, capacity=256 * 1024 * 1024):
+        self.path = path
+        self.frames = 0
+        self._file = open(path, "w+b")
+        self._capacity = 0
+        self._mm = None
+        self._grow(max(capacity, len(MAGIC) + RECORD_HEADER.size))
+        self._mm[:len(MAGIC)] = MAGIC
+        self._used = len(MAGIC)
+
+    def _grow(self, capacity):
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm.close()
+        self._file.truncate(capacity)
+        self._capacity = capacity
+        self._mm = mmap.mmap(self._file.fileno(), capacity)
+
+    def record(self, container, camera=0):
+        payload = container[6]
+        size = RECORD_HEADER.size + len(payload)
+        if self._used + size > self._capacity:
+            self._grow(max(self._capacity * 2, self._used + size))
+        RECORD_HEADER.pack_into(self._mm, self._used, container[0], container[1], container[2],
+                                container[3], container[4], container[5], camera, len(payload))
+        dest = np.frombuffer(self._mm, dtype=np.uint8, count=len(payload),
+                             offset=self._used + RECORD_HEADER.size)
+        dest[:] = np.frombuffer(payload, dtype=np.uint8)
+        del dest
+        self._used += size
+        self.frames += 1
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm.close()
+            self._mm = None
+            self._file.truncate(self._used)
+            self._file.close()
+
+
+class ReplayVideoDevice(object):
+    """Stand-in for the ALVideoDevice proxy that serves a recording.
+
+    Payloads are numpy views of the mapped file, so decoding a replayed
+    frame copies nothing. With realtime=False frames are served as fast as
+    the caller asks for them; with realtime=True the recorded spacing is
+    reproduced. Each handle walks the frames of its camera; at the end
+    getImageRemote returns None unless loop=True. The requested resolution
+    and color space are ignored, so subscribe with the recorded ones.
+    """
+
+    def __init__(self, path, realtime=False, loop=False):
+        self.realtime = realtime
+        self.loop = loop
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a frame recording".format(path))
+        self._records = {}
+        offset = len(MAGIC)
+        size = len(self._mm)
+        while offset + RECORD_HEADER.size <= size:
+            header = RECORD_HEADER.unpack_from(self._mm, offset)
+            if offset + RECORD_HEADER.size + header[7] > size:
+                break
+            self._records.setdefault(header[6], []).append((offset, header))
+            offset += RECORD_HEADER.size + header[7]
+        self._handles = {}
+        self._next_id = 0
+
+    def cameras(self):
+        return sorted(self._records)
+
+    def __len__(self):
+        return sum(len(records) for records in self._records.values())
+
+    def _new_handle(self, name, cameras):
+        handle = "{}_{}".format(name, self._next_id)
+        self._next_id += 1
+        self._handles[handle] = {"cameras": cameras, "cursor": 0, "start": None}
+        return handle
+
+    def subscribeCamera(self, name, camera, resolution, color_space, fps):
+        return self._new_handle(name, [camera])
+
+    def subscribe(self, name, resolution, color_space, fps):
+        return self._new_handle(name, [self.cameras()[0]])
+
+    def subscribeCameras(self, name, cameras, resolutions, color_spaces, fps):
+        return self._new_handle(name, list(cameras))
+
+    def unsubscribe(self, handle):
+        self._handles.pop(handle, None)
+
+    def setResolution(self, handle, resolution):
+        return True
+
+    def setFrameRate(self, handle, fps):
+        return True
+
+    def releaseImage(self, handle):
+        pass
+
+    def _container(self, camera, cursor):
+        records = self._records.get(camera, [])
+        if not records:
+            return None
+        if cursor >= len(records):
+            if not self.loop:
+                return None
+            cursor %= len(records)
+        offset, header = records[cursor]
+        width, height, layers, color_space, seconds, micros, cam, length = header
+        payload = np.frombuffer(self._mm, dtype=np.uint8, count=length,
+                                offset=offset + RECORD_HEADER.size)
+        return [width, height, layers, color_space, seconds, micros, payload, cam]
+
+    def _pace(self, state, container):
+        if not self.realtime or container is None:
+            return
+        stamp = container[4] + container[5] * 1e-6
+        if state["start"] is None:
+            state["start"] = (time.time(), stamp)
+            return
+        wall_start, stamp_start = state["start"]
+        delay = (stamp - stamp_start) - (time.time() - wall_start)
+        if delay > 0:
+            time.sleep(delay)
+
+    def getImagesRemote(self, handle):
+        state = self._handles[handle]
+        containers = [self._container(camera, state["cursor"]) for camera in state["cameras"]]
+        if any(c is None for c in containers):
+            return None
+        state["cursor"] += 1
+        self._pace(state, containers[0])
+        return containers
+
+    def getImageRemote(self, handle):
+        containers = self.getImagesRemote(handle)
+        return containers[0] if containers else None
+
+    def close(self):
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # todavia hay frames en uso; el mapa se libera con ellos
+        self._file.close()
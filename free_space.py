@@ -0,0 +1,64 @@
+# -*- encoding: UTF-8 -*-
+"""Per-sector obstacle scores from a bottom-camera edge map."""
+
+import numpy as np
+
+SECTORS = ("left", "center", "right")
+
+# Campo de vision horizontal de las camaras del NAO (60.97 grados)
+CAMERA_HFOV = 1.064
+
+_row_weights = {}
+
+
+def _weights(height, band):
+    """Row weights for the floor band, growing towards the bottom (closer floor)."""
+    key = (height, band)
+    weights = _row_weights.get(key)
+    if weights is None:
+        top = int(height * band[0])
+        bottom = int(height * band[1])
+        weights = np.zeros(height, dtype=np.float32)
+        weights[top:bottom] = np.linspace(0.5, 1.0, bottom - top)
+        weights /= weights.sum()
+        _row_weights[key] = weights
+    return weights
+
+
+def sector_scores(edges, sectors=3, band=(0.4, 1.0)):
+    """Weighted edge density of the floor band in each vertical sector.
+
+    Returns an array of sectors scores from left to right; higher means
+    more clutter. band selects the rows to use as fractions of the height.
+    """
+    height, width = edges.shape[:2]
+    column_scores = _weights(height, band).dot(edges.reshape(height, width) > 0)
+    usable = width - width % sectors
+    return column_scores[:usable].reshape(sectors, -1).mean(axis=1)
+
+
+def freest_side(scores):
+    """'left' or 'right', whichever outer sector has less clutter."""
+    return "left" if scores[0] <= scores[-1] else "right"
+
+
+def turn_angle(scores, side=None, max_extra=CAMERA_HFOV / 2.0):
+    """Signed rotation (positive = left, as in moveTo) towards an outer sector.
+
+    side is 'left' or 'right'; by default the freest one. The robot turns
+    at least until the centre of that sector is straight ahead. The more cluttered that sector is relative to the worst one,
+    the further past it the robot turns (up to max_extra radians more),
+    so the camera ends up on floor it has not seen yet.
+    """
+    sectors = len(scores)
+    sector_center = CAMERA_HFOV * (sectors - 1) / (2.0 * sectors)
+    side = side or freest_side(scores)
+    chosen = scores[0] if side == "left" else scores[-1]
+    worst = float(max(scores))
+    clutter = float(chosen) / worst if worst > 0 else 0.0
+    angle = sector_center + clutter * max_extra
+    return angle if side == "left" else -angle
+
+
+def describe(scores):
+    return ", ".join("{} {:.3f}".format(name, score) for name, score in zip(SECTORS, scores))
@@ -0,0 +1,123 @@
+# -*- encoding: UTF-8 -*-
+"""Pixel-to-floor lookup tables for the bottom camera and camera range profiles."""
+
+import collections
+import math
+
+import numpy as np
+
+# Geometria del NAO V5 (metros / radianes)
+NECK_HEIGHT = 0.4465          # articulacion HeadPitch sobre el suelo, de pie tras moveInit
+BOTTOM_CAMERA_OFFSET = (0.05071, 0.01774)   # (x, z) en el marco de la cabeza
+BOTTOM_CAMERA_PITCH = 0.6929  # 39.7 grados hacia abajo
+CAMERA_HFOV = 1.064           # 60.97 grados
+CAMERA_VFOV = 0.8315          # 47.64 grados
+
+RangeProfile = collections.namedtuple("RangeProfile", ["ranges", "rows"])
+SideRanges = collections.namedtuple("SideRanges", ["left", "center", "right"])
+
+
+class GroundPlane(object):
+    """Floor coordinates of every pixel for one resolution and head pose.
+
+    forward, lateral and distance are H x W float32 arrays in the robot
+    frame (x forward, y to the left), measured from the point below the
+    neck. Pixels above the horizon are inf.
+    """
+
+    def __init__(self, width, height, head_yaw=0.0, head_pitch=0.0, neck_height=NECK_HEIGHT):
+        cam_x, cam_z = BOTTOM_CAMERA_OFFSET
+        # posicion de la camara tras girar la cabeza en pitch
+        self.camera_forward = cam_x * math.cos(head_pitch) + cam_z * math.sin(head_pitch)
+        self.camera_height = neck_height - cam_x * math.sin(head_pitch) + cam_z * math.cos(head_pitch)
+        pitch = BOTTOM_CAMERA_PITCH + head_pitch
+
+        fx = (width / 2.0) / math.tan(CAMERA_HFOV / 2.0)
+        fy = (height / 2.0) / math.tan(CAMERA_VFOV / 2.0)
+        u = (np.arange(width, dtype=np.float32) + 0.5 - width / 2.0) / fx
+        v = (np.arange(height, dtype=np.float32) + 0.5 - height / 2.0) / fy
+        ray_left = -u[None, :]
+        ray_up = -v[:, None]
+
+        ray_x = math.cos(pitch) + math.sin(pitch) * ray_up
+        ray_z = -math.sin(pitch) + math.cos(pitch) * ray_up
+        with np.errstate(divide="ignore"):
+            t = np.where(ray_z < 0, self.camera_height / -ray_z, np.inf).astype(np.float32)
+        x = np.broadcast_to(ray_x * t, (height, width))
+        y = ray_left * t
+        forward = (x * math.cos(head_yaw) - y * math.sin(head_yaw))
+        lateral = (x * math.sin(head_yaw) + y * math.cos(head_yaw))
+        yaw_x = self.camera_forward * math.cos(head_yaw)
+        yaw_y = self.camera_forward * math.sin(head_yaw)
+        self.forward = np.where(np.isfinite(t), forward + yaw_x, np.inf).astype(np.float32)
+        self.lateral = np.where(np.isfinite(t), lateral + yaw_y, 0.0).astype(np.float32)
+        self.distance = np.hypot(self.forward, self.lateral).astype(np.float32)
+        self.bearing = np.arctan2(self.lateral, self.forward).astype(np.float32)
+        self._columns = np.arange(width)
+
+
+# Una tabla VGA ocupa ~5 MB: se guardan solo las mas recientes
+ANGLE_STEP = 0.02
+MAX_TABLES = 8
+
+_tables = collections.OrderedDict()
+
+
+def _quantize(angle):
+    return round(angle / ANGLE_STEP) * ANGLE_STEP
+
+
+def ground_plane(width, height, head_yaw=0.0, head_pitch=0.0):
+    """Cached GroundPlane; angles snap to ANGLE_STEP rad and the MAX_TABLES most recent are kept."""
+    key = (width, height, _quantize(head_yaw), _quantize(head_pitch))
+    table = _tables.pop(key, None)
+    if table is None:
+        table = GroundPlane(width, height, key[2], key[3])
+        while len(_tables) >= MAX_TABLES:
+            _tables.popitem(last=False)
+    _tables[key] = table
+    return table
+
+
+def range_profile(edges, table):
+    """Floor distance of the lowest edge pixel in every column (inf if none)."""
+    height = edges.shape[0]
+    flipped = edges.reshape(height, -1)[::-1] > 0
+    lowest = flipped.argmax(axis=0)
+    found = flipped[lowest, table._columns]
+    rows = height - 1 - lowest
+    ranges = np.where(found, table.distance[rows, table._columns], np.inf)
+    return RangeProfile(ranges, np.where(found, rows, -1))
+
+
+def side_ranges(profile, table, center_half_width=0.17):
+    """Nearest camera range to the left, ahead and to the right of the robot.
+
+    Columns are split by the bearing of their lowest edge: within
+    center_half_width radians of straight ahead counts as center.
+    """
+    rows = np.maximum(profile.rows, 0)
+    bearing = table.bearing[rows, table._columns]
+    ranges = profile.ranges
+
+    def nearest(mask):
+        return float(ranges[mask].min()) if mask.any() else float("inf")
+    return SideRanges(nearest(bearing > center_half_width),
+                      nearest(np.abs(bearing) <= center_half_width),
+                      nearest(bearing < -center_half_width))
+
+
+def nearest_sides(*profiles):
+    """Element-wise nearest of several SideRanges."""
+    return SideRanges(*[min(ranges) for ranges in zip(*profiles)])
+
+
+def fuse_with_sonar(sides, sonar_left, sonar_right):
+    """Combines camera side ranges with the two sonar readings (nearest wins).
+
+    Both sonar cones overlap straight ahead, so the center also takes the
+    nearer of the two sonar values.
+    """
+    return SideRanges(min(sides.left, sonar_left),
+                      min(sides.center, sonar_left, sonar_right),
+                      min(sides.right, sonar_right))
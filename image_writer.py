@@ -0,0 +1,147 @@
+# -*- encoding: UTF-8 -*-
+"""Background image persistence so disk writes never block a stop decision."""
+
+import collections
+import struct
+import threading
+import time
+
+import cv2
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+
+# Cabecera de cada imagen en formato raw: alto, ancho, capas
+RAW_HEADER = struct.Struct("<III")
+
+
+def encode(image, fmt, jpeg_quality=90):
+    """Encodes image as "png", "jpeg" or "raw" bytes."""
+    if fmt == "raw":
+        layers = image.shape[2] if image.ndim == 3 else 1
+        return RAW_HEADER.pack(image.shape[0], image.shape[1], layers) + image.tobytes()
+    if fmt == "jpeg":
+        ok, data = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality])
+    elif fmt == "png":
+        ok, data = cv2.imencode(".png", image)
+    else:
+        raise ValueError("Unknown image format: {}".format(fmt))
+    if not ok:
+        raise RuntimeError("Could not encode image as {}".format(fmt))
+    return data.tobytes()
+
+
+class AsyncImageWriter(object):
+    """Encodes and writes images from a worker thread through a bounded queue.
+
+    save() only copies the image and enqueues it. When the queue is full the
+    drop policy decides which image is lost: DROP_NEWEST refuses the new
+    one, DROP_OLDEST evicts the oldest queued one. PNG and JPEG replace the
+    target file; "raw" appends header + pixels to it, so one file holds a
+    chunk of frames. archive() sends the encoded bytes to a FrameArchive
+    instead of a file.
+    """
+
+    def __init__(self, max_queue=8, drop_policy=DROP_OLDEST, fmt="png", jpeg_quality=90):
+        if drop_policy not in (DROP_NEWEST, DROP_OLDEST):
+            raise ValueError("Unknown drop policy: {}".format(drop_policy))
+        self.max_queue = max_queue
+        self.drop_policy = drop_policy
+        self.fmt = fmt
+        self.jpeg_quality = jpeg_quality
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.encode_time = 0.0
+
+    def start(self):
+        # el candado evita que dos hilos que guardan a la vez arranquen dos workers
+        with self._cond:
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name="AsyncImageWriter")
+                self._thread.daemon = True
+                self._thread.start()
+        return self
+
+    def stop(self, flush=True, timeout=5.0):
+        with self._cond:
+            if not flush:
+                self.dropped += len(self._queue)
+                self._queue.clear()
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def save(self, path, image, fmt=None):
+        """Queues a copy of image for writing. Returns False if it was dropped."""
+        return self._enqueue((path, image.copy(), fmt or self.fmt, self.jpeg_quality, None))
+
+    def archive(self, archive, image, timestamp, fmt=None, **meta):
+        """Queues a copy of image for archive.append_encoded(), at the archive's JPEG quality."""
+        meta["timestamp"] = timestamp
+        return self._enqueue((archive, image.copy(), fmt or archive.fmt, archive.jpeg_quality, meta))
+
+    def _enqueue(self, job):
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                if self.drop_policy == DROP_NEWEST:
+                    return False
+                self._queue.popleft()
+            self._queue.append(job)
+            self.queued += 1
+            self._cond.notify()
+            if self._thread is None:
+                self.start()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                target, image, fmt, quality, meta = self._queue.popleft()
+            try:
+                self._write(target, image, fmt, quality, meta)
+                self.written += 1
+            except Exception as e:
+                self.errors += 1
+                print("Error saving image {}: {}".format(target, e))
+
+    def _write(self, target, image, fmt, quality, meta):
+        start = time.time()
+        data = encode(image, fmt, quality)
+        self.encode_time += time.time() - start
+        if meta is not None:
+            target.append_encoded(data, fmt, **meta)
+            return
+        with open(target, "ab" if fmt == "raw" else "wb") as f:
+            f.write(data)
+
+    def pending(self):
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "pending": self.pending(),
+            "encode_ms": self.encode_time / self.written * 1000.0 if self.written else 0.0,
+        }
+
+    def format_stats(self):
+        return ("Image writer: {queued} queued, {written} written, {dropped} dropped, "
+                "{errors} errors, {pending} pending, {encode_ms:.1f} ms per encode").format(**self.stats())
@@ -0,0 +1,111 @@
+# -*- encoding: UTF-8 -*-
+"""Local copy of ALMemory keys kept current by the events that carry their values."""
+
+import threading
+import time
+
+from sensor_snapshot import SONAR_LEFT, SONAR_RIGHT
+
+# Los eventos "Detected" de ALSonar llevan como valor la distancia del primer eco
+SONAR_EVENT_KEYS = {
+    "SonarLeftDetected": SONAR_LEFT,
+    "SonarRightDetected": SONAR_RIGHT,
+}
+
+# El valor de los "NothingDetected" no es una distancia: solo invalidan la copia
+SONAR_STALE_EVENTS = {
+    "SonarLeftNothingDetected": SONAR_LEFT,
+    "SonarRightNothingDetected": SONAR_RIGHT,
+}
+
+
+class MemoryMirror(object):
+    """Dictionary of ALMemory values with their age.
+
+    Values arrive through on_event(), called from the module's existing
+    event handlers or from micro-event subscriptions made with subscribe().
+    Only events in events carry the value of their key; an event in
+    stale_events just drops the mirrored value of its key. get() /
+    get_many() answer locally while a value is at most max_age seconds
+    old, and fetch only the stale keys with one getListData call
+    otherwise.
+    """
+
+    def __init__(self, memory, events=SONAR_EVENT_KEYS, stale_events=SONAR_STALE_EVENTS, max_age=0.5):
+        self.memory = memory
+        self.events = dict(events)
+        self.stale_events = dict(stale_events)
+        self.max_age = max_age
+        self._values = {}
+        self._lock = threading.Lock()
+        self._subscribed = []
+        self.events_received = 0
+        self.lookups = 0
+        self.hits = 0
+        self.rpcs = 0
+
+    def on_event(self, event, value):
+        """Stores the value an event carried under the key it mirrors, or marks the key stale."""
+        if event in self.stale_events:
+            with self._lock:
+                self._values.pop(self.stale_events[event], None)
+                self.events_received += 1
+            return
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return
+        with self._lock:
+            self._values[self.events.get(event, event)] = (value, time.time())
+            self.events_received += 1
+
+    def subscribe(self, module_name, method="onMirrorEvent", events=None):
+        """Subscribes module_name.method(key, value, message) to the micro events.
+
+        Only for events the module does not already handle; those feed the
+        mirror from their own handler.
+        """
+        if events is None:
+            events = list(self.events) + list(self.stale_events)
+        for event in events:
+            self.memory.subscribeToMicroEvent(event, module_name, event, method)
+            self._subscribed.append((event, module_name))
+
+    def unsubscribe(self):
+        for event, module_name in self._subscribed:
+            try:
+                self.memory.unsubscribeToMicroEvent(event, module_name)
+            except Exception as e:
+                print("Error unsubscribing mirror from {}: {}".format(event, e))
+        self._subscribed = []
+
+    def age(self, key):
+        """Seconds since key was last updated, or None if it never was."""
+        with self._lock:
+            entry = self._values.get(key)
+        return None if entry is None else time.time() - entry[1]
+
+    def get_many(self, keys, max_age=None):
+        max_age = self.max_age if max_age is None else max_age
+        now = time.time()
+        with self._lock:
+            entries = [self._values.get(key) for key in keys]
+        stale = [key for key, entry in zip(keys, entries) if entry is None or now - entry[1] > max_age]
+        fetched = {}
+        if stale:
+            values = self.memory.getListData(stale)
+            received = time.time()
+            fetched = dict(zip(stale, values))
+            with self._lock:
+                for key, value in fetched.items():
+                    self._values[key] = (value, received)
+        with self._lock:
+            self.lookups += len(keys)
+            self.hits += len(keys) - len(stale)
+            self.rpcs += 1 if stale else 0
+        return [fetched[key] if key in fetched else entry[0] for key, entry in zip(keys, entries)]
+
+    def get(self, key, max_age=None):
+        return self.get_many([key], max_age)[0]
+
+    def format_stats(self):
+        return ("Memory mirror: {} events, {} of {} key lookups served locally, "
+                "{} getListData calls made").format(self.events_received, self.hits, self.lookups, self.rpcs)
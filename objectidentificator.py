@@ -5,6 +5,8 @@ from naoqi import ALProxy
 from naoqi import ALBroker
 from naoqi import ALModule
 
+from sonar_events import SonarEventCoalescer, avoid_until_clear
+
 NAO_IP = "10.42.0.134"
 SonarHandler = None
 memory = None
@@ -25,11 +27,15 @@ class SonarHandlerModule(ALModule):
         self.is_turning = False  
         self.move_delay = 1  
 
+        self.sonar_events = SonarEventCoalescer(self.on_sonar_transition, window=0.3,
+                                                safe_distance=self.safe_distance, memory=memory)
+        self.max_avoid_turns = 4
+        self.sonar_events.start()
 
-        memory.subscribeToEvent("SonarLeftDetected", "SonarHandler", "onSonarLeftDetected")
-        memory.subscribeToEvent("SonarRightDetected", "SonarHandler", "onSonarRightDetected")
-        memory.subscribeToEvent("SonarLeftNothingDetected", "SonarHandler", "onSonarNothingDetected")
-        memory.subscribeToEvent("SonarRightNothingDetected", "SonarHandler", "onSonarNothingDetected")
+        memory.subscribeToEvent("SonarLeftDetected", "SonarHandler", "onSonarEvent")
+        memory.subscribeToEvent("SonarRightDetected", "SonarHandler", "onSonarEvent")
+        memory.subscribeToEvent("SonarLeftNothingDetected", "SonarHandler", "onSonarEvent")
+        memory.subscribeToEvent("SonarRightNothingDetected", "SonarHandler", "onSonarEvent")
 
 
         self.start_moving_forward()
@@ -62,27 +68,20 @@ class SonarHandlerModule(ALModule):
         self.is_turning = False
 
 
-    def onSonarRightDetected(self, *_args):
-        print("RightSonarDetected")
-        distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
-        print("Right sonar detected an object at distance: {:.2f} m".format(distance))
-
-        if distance < self.safe_distance and not self.is_turning:
-            self.stop_moving_forward()
-            self.move_laterally('left')
+    def turn_direction(self, side):
+        return 'left' if side == 'right' else 'right'
 
-    def onSonarLeftDetected(self, *_args):
-        print("LeftSonarDetected")
-        distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
-        print("Left sonar detected an object at distance: {:.2f} m".format(distance))
+    def onSonarEvent(self, event, value, _subscriber):
+        self.sonar_events.push(event, value)
 
-        if distance < self.safe_distance and not self.is_turning:
-            self.stop_moving_forward()  
-            self.move_laterally('right')  
+    def on_sonar_transition(self, state):
+        avoid_until_clear(self.sonar_events, state, self.stop_moving_forward,
+                          lambda side: self.move_laterally(self.turn_direction(side)),
+                          self.resume_forward, self.max_avoid_turns)
 
-    def onSonarNothingDetected(self, *_args):
+    def resume_forward(self):
         print("No obstacles detected by sonar, resuming forward movement.")
-        self.start_moving_forward()  
+        self.start_moving_forward()
 
 def main():
     myBroker = ALBroker("myBroker", "0.0.0.0", 0, NAO_IP, 9559)
@@ -95,6 +94,8 @@ def main():
 
     except KeyboardInterrupt:
         print("Keyboard Interruption")
+        SonarHandler.sonar_events.stop()
+        print(SonarHandler.sonar_events.format_stats())
         myBroker.shutdown()
         sys.exit(0)
 
@@ -1,12 +1,17 @@
 import sys
 import time
-import cv2
-import numpy as np
 from naoqi import ALProxy, ALBroker, ALModule
+from camera_session import CameraSession, BOTTOM_CAMERA, kVGA, kBGRColorSpace
+from frame_decoder import decode
+from vision_checks import detect_lines
+from free_space import sector_scores, freest_side, describe
+from memory_mirror import MemoryMirror
+from sensor_snapshot import SONAR_LEFT, SONAR_RIGHT
 
 NAO_IP = "localhost"
 SonarHandler = None
 memory = None
+mirror = None
 cameraProxy = None
 
 class SonarHandlerModule(ALModule):
@@ -17,14 +22,20 @@ class SonarHandlerModule(ALModule):
             self.motion = ALProxy("ALMotion")
             global memory
             memory = ALProxy("ALMemory")
+            # Copia local de las distancias, actualizada por los eventos del sonar
+            global mirror
+            mirror = MemoryMirror(memory)
             global cameraProxy
             cameraProxy = ALProxy("ALVideoDevice")
+            self.camera = CameraSession(cameraProxy, "SonarHandlerBottom", BOTTOM_CAMERA, kVGA, kBGRColorSpace, 5)
+            self.camera.open()
 
             sonarProxy = ALProxy("ALSonar")
             sonarProxy.subscribe("SonarApp")
             print("Sonar and camera activated. Reading values...")
 
             self.safe_distance = 0.5
+            self.sector_scores = None
             self.is_moving_forward = False
             self.is_turning = False
             self.turning_direction = 'left' 
@@ -91,10 +102,11 @@ class SonarHandlerModule(ALModule):
         except Exception as e:
             print("Error turning {}: {}".format(direction)(e))
 
-    def onSonarRightDetected(self, *_args):
+    def onSonarRightDetected(self, event, value, _subscriber):
         print("RightSonarDetected")
+        mirror.on_event(event, value)
         try:
-            distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
+            distance = mirror.get(SONAR_RIGHT)
             print("Right sonar detected an object at distance: {}".format(distance))
             if distance < self.safe_distance and not self.is_turning:
                 self.stop_moving_forward()
@@ -103,10 +115,11 @@ class SonarHandlerModule(ALModule):
         except Exception as e:
             print("Error handling right sonar detection: {}".format(e))
 
-    def onSonarLeftDetected(self, *_args):
+    def onSonarLeftDetected(self, event, value, _subscriber):
         print("LeftSonarDetected")
+        mirror.on_event(event, value)
         try:
-            distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
+            distance = mirror.get(SONAR_LEFT)
             print("Left sonar detected an object at distance: {}".format(distance))
             if distance < self.safe_distance and not self.is_turning:
                 self.stop_moving_forward()
@@ -115,8 +128,9 @@ class SonarHandlerModule(ALModule):
         except Exception as e:
             print("Error handling left sonar detection: {}".format(e))
 
-    def onSonarNothingDetected(self, *_args):
+    def onSonarNothingDetected(self, event, value, _subscriber):
         print("No obstacles detected by sonar, checking camera for lines...")
+        mirror.on_event(event, value)
         try:
             self.process_image()
             if self.is_clear_path():
@@ -124,24 +138,23 @@ class SonarHandlerModule(ALModule):
                 self.start_moving_forward()
             else:
                 print("Obstacle detected by camera, continuing to turn.")
+                if self.sector_scores is not None:
+                    print("Camera sectors: {}".format(describe(self.sector_scores)))
+                    self.turning_direction = freest_side(self.sector_scores)
                 self.move_laterally(self.turning_direction)
         except Exception as e:
             print("Error handling sonar nothing detected: {}",format(e))
 
     def process_image(self):
         try:
-            resolution = 2
-            colorSpace = 13
-            video = cameraProxy.getImageRemote(cameraProxy.subscribe("CameraBottom", resolution, colorSpace, 5))
+            video = self.camera.get_image()
 
             if video is None:
                 return
 
-            image = np.frombuffer(video[6], dtype=np.uint8)
-            image = image.reshape((video[1], video[0], 3))
-            gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            edges = cv2.Canny(gray_image, 50, 150)
-            lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=50, minLineLength=50, maxLineGap=10)
+            image = decode(video, 3)
+            edges, lines = detect_lines(image, "bottom", threshold=50, min_line_length=50, max_line_gap=10)
+            self.sector_scores = sector_scores(edges)
 
             if lines is not None and len(lines) > 4:
                 print("Detected {} lines. Obstacle detected.".format(len(lines)))
@@ -151,8 +164,7 @@ class SonarHandlerModule(ALModule):
 
     def is_clear_path(self):
         try:
-            right_distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
-            left_distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
+            right_distance, left_distance = mirror.get_many([SONAR_RIGHT, SONAR_LEFT])
             return right_distance > self.safe_distance and left_distance > self.safe_distance
         except Exception as e:
             print("Error checking clear path: {}".format(e))
@@ -170,6 +182,9 @@ def main():
         print("Keyboard Interruption")
         if SonarHandler:
             SonarHandler.stop_moving_forward()
+            print(SonarHandler.camera.format_stats())
+            SonarHandler.camera.close()
+            print(mirror.format_stats())
         sys.exit(0)
     except Exception as e:
         print("Error in main: {}".format(e))
@@ -0,0 +1,58 @@
+# -*- encoding: UTF-8 -*-
+"""Runs the obstacle checks over a recording as fast as the CPU allows.
+
+Every variant sees the same frames: trescin.py's edge count and bottom.py's
+Hough line count, plain, undistorted (if the camera is calibrated, see
+undistort.py) and cropped to the camera ROI.
+Per-stage timing and allocations are printed at the end.
+
+Usage: python replay_bench.py pasillo.frames [camera]
+"""
+
+import sys
+
+from camera_session import CameraSession
+from frame_recorder import ReplayVideoDevice
+from roi import ROIS
+from undistort import calibrated
+from vision_pipeline import Capture, Pipeline, edge_count_pipeline, hough_pipeline
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    video_proxy = ReplayVideoDevice(sys.argv[1])
+    camera = int(sys.argv[2]) if len(sys.argv) > 2 else video_proxy.cameras()[0]
+    session = CameraSession(video_proxy, "replay", camera)
+
+    capture = Pipeline("capture", [Capture(session)])
+    variants = [edge_count_pipeline(), hough_pipeline(threshold=50),
+                hough_pipeline(threshold=50, roi=ROIS[camera], name="hough_roi")]
+    if calibrated(camera):
+        variants.append(hough_pipeline(threshold=50, undistort_camera=camera, name="hough_undistorted"))
+    else:
+        print("Camera {} has no calibration; skipping the undistorted variant".format(camera))
+    blocked = dict((pipeline.name, 0) for pipeline in variants)
+    while True:
+        frame = capture.run()
+        if frame is None:
+            break
+        for pipeline in variants:
+            state = pipeline.run(frame["image"], frame["timestamp"], tag="replay")
+            if not state["clear"]:
+                blocked[pipeline.name] += 1
+
+    session.close()
+    if not capture.frames:
+        print("No frames for camera {} in {}".format(camera, sys.argv[1]))
+        return
+    print("{} frames from camera {}".format(capture.frames, camera))
+    print(capture.format_stats())
+    for pipeline in variants:
+        print(pipeline.format_stats())
+        print("  {} blocked".format(blocked[pipeline.name]))
+
+
+if __name__ == "__main__":
+    main()
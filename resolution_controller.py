@@ -0,0 +1,171 @@
+# -*- encoding: UTF-8 -*-
+"""Picks capture resolution per check: cheap while walking, full when unsure."""
+
+import collections
+import time
+
+import numpy as np
+
+from camera_session import kQVGA, kVGA, RESOLUTION_SIZES
+from adaptive_canny import DEFAULT_THRESHOLDS, adaptive_canny
+from artifact_cache import artifact_cache
+from change_gate import Undecided, decided
+from vision_checks import detect_edges
+
+# Umbral de trescin.py, expresado como bordes equivalentes a VGA
+VGA_EDGE_THRESHOLD = 1000.0
+
+# (resolucion, fps) por caso de uso
+USE_CASES = {
+    "walking": (kQVGA, 15),
+    "full": (kVGA, 5),
+}
+
+CameraCheck = collections.namedtuple("CameraCheck", ["clear", "scores", "edges", "escalated", "elapsed"])
+
+
+def normalized_edge_count(edge_count, width):
+    """Scales an edge pixel count to what the same scene gives at VGA.
+
+    Edge pixels trace contours, so their number grows with the linear size
+    of the image rather than its area. Scaling by 640 / width keeps the
+    VGA-tuned threshold valid at every resolution.
+    """
+    return edge_count * (float(RESOLUTION_SIZES[kVGA][0]) / width)
+
+
+class ResolutionController(object):
+    """Runs the edge check on a low-resolution stream and escalates when unsure.
+
+    fast_grabber keeps the walking stream (single camera or dual pair) in
+    memory. When a score falls within margin of the threshold, one frame is
+    fetched from full_session and the check is repeated at full resolution,
+    but only if the measured cost of doing so fits in the decision budget.
+    An optional ChangeGate reuses the previous CameraCheck while the scene
+    stays the same. With a VisionWorkerPool the cameras are scored in
+    parallel worker processes; CameraCheck.edges is None there unless
+    keep_edges is set. A frame the pool drops or does not answer in time
+    is undecided: check() returns the previous CameraCheck (None before
+    the first one). With
+    adaptive=True the Canny thresholds follow the scene brightness
+    (adaptive_canny) instead of the fixed (50, 150).
+    """
+
+    def __init__(self, fast_grabber, full_session, threshold=VGA_EDGE_THRESHOLD,
+                 margin=0.25, budget=0.2, tags=("top", "bottom"), gate=None, pool=None,
+                 adaptive=False, keep_edges=False):
+        self.fast = fast_grabber
+        self.full = full_session
+        self.threshold = threshold
+        self.margin = margin
+        self.budget = budget
+        self.tags = tags
+        self.gate = gate
+        self.pool = pool
+        self.job_params = {"adaptive_canny": adaptive}
+        self.keep_edges = keep_edges
+        self.last_check = None
+        self.full_buffer = np.zeros(full_session.shape(), dtype=np.uint8)
+        self.full_cost = None
+        self.checks = 0
+        self.escalations = 0
+        self.over_budget = 0
+        self.undecided = 0
+
+    def _score(self, image, timestamp):
+        images = image if image.ndim == 4 else [image]
+        if self.pool is not None:
+            return self._score_in_pool(images, timestamp)
+        scores = []
+        edges = []
+        for tag, single in zip(self.tags, images):
+            artifacts = artifact_cache.get(single, tag, timestamp)
+            thresholds = adaptive_canny.thresholds(artifacts.gray()) if self.job_params["adaptive_canny"] \
+                else DEFAULT_THRESHOLDS
+            edge_map, edge_count = detect_edges(single, tag, artifacts=artifacts, thresholds=thresholds)
+            scores.append(normalized_edge_count(edge_count, single.shape[1]))
+            edges.append(edge_map)
+        return scores, edges
+
+    def _score_in_pool(self, images, timestamp):
+        """(scores, edges), or None if any camera's frame was undecided."""
+        tasks = [self.pool.submit(single, "edge_check", tag, timestamp,
+                                  return_edges=self.keep_edges, **self.job_params)
+                 for tag, single in zip(self.tags, images)]
+        results = [self.pool.wait(task, self.budget * 5) for task in tasks]
+        if any(result is None for result in results):
+            return None
+        scores = [normalized_edge_count(result["edge_count"], result["width"]) for result in results]
+        edges = [result["edges"] for result in results] if self.keep_edges else None
+        return scores, edges
+
+    def _ambiguous(self, scores):
+        band = self.margin * self.threshold
+        return any(abs(score - self.threshold) < band for score in scores)
+
+    def _escalate(self):
+        start = time.time()
+        timestamp = self.full.read_into(self.full_buffer)
+        if timestamp is None:
+            return None
+        result = self._score(self.full_buffer, timestamp)
+        elapsed = time.time() - start
+        if self.full_cost is None:
+            self.full_cost = elapsed
+        else:
+            self.full_cost = 0.8 * self.full_cost + 0.2 * elapsed
+        return result
+
+    def check(self):
+        """Returns a CameraCheck, or None if no frame has been captured yet."""
+        frame = self.fast.latest()
+        if frame is None:
+            return None
+        if self.gate is not None:
+            return self.gate.check(frame.image, lambda: self._check(frame))
+        return decided(self._check(frame))
+
+    def _check(self, frame):
+        start = time.time()
+        self.checks += 1
+        scored = self._score(frame.image, frame.timestamp)
+        if scored is None:
+            # frame sin decidir: se mantiene la decision anterior
+            self.undecided += 1
+            return Undecided(self.last_check)
+        scores, edges = scored
+        escalated = False
+        fresh = True
+
+        if self._ambiguous(scores):
+            spent = time.time() - start
+            if self.full_cost is None or spent + self.full_cost <= self.budget:
+                result = self._escalate()
+                if result is not None:
+                    scores, edges = result
+                    escalated = True
+                    self.escalations += 1
+            else:
+                self.over_budget += 1
+            # ambiguo y sin escalar: se usa, pero la puerta de cambios no lo guarda
+            fresh = escalated
+
+        clear = all(score <= self.threshold for score in scores)
+        self.last_check = CameraCheck(clear, scores, edges, escalated, time.time() - start)
+        return self.last_check if fresh else Undecided(self.last_check)
+
+    def stats(self):
+        return {
+            "checks": self.checks,
+            "escalations": self.escalations,
+            "escalation_rate": float(self.escalations) / self.checks if self.checks else 0.0,
+            "over_budget": self.over_budget,
+            "undecided": self.undecided,
+            "full_cost_ms": (self.full_cost or 0.0) * 1000.0,
+        }
+
+    def format_stats(self):
+        return ("Resolution controller: {checks} checks, {escalations} escalated to full "
+                "resolution ({escalation_rate:.0%}), {over_budget} skipped over budget, "
+                "{undecided} undecided, "
+                "full check {full_cost_ms:.1f} ms").format(**self.stats())
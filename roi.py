@@ -0,0 +1,70 @@
+# -*- encoding: UTF-8 -*-
+"""Per-camera regions of interest: a trapezoid of floor ahead of the feet."""
+
+import numpy as np
+
+from camera_session import TOP_CAMERA, BOTTOM_CAMERA
+
+
+class RegionOfInterest(object):
+    """Trapezoid given as fractions of the frame.
+
+    rows is the (top, bottom) band; top_cols and bottom_cols are the
+    (left, right) extent of the trapezoid on its top and bottom rows.
+    crop() returns a view of the bounding box, and mask() marks the pixels
+    of that box that are inside the trapezoid.
+    """
+
+    def __init__(self, rows=(0.0, 1.0), top_cols=(0.0, 1.0), bottom_cols=(0.0, 1.0)):
+        self.rows = rows
+        self.top_cols = top_cols
+        self.bottom_cols = bottom_cols
+        self._masks = {}
+
+    def bounds(self, width, height):
+        """(y0, y1, x0, x1) of the bounding box in pixels."""
+        left = min(self.top_cols[0], self.bottom_cols[0])
+        right = max(self.top_cols[1], self.bottom_cols[1])
+        return (int(round(self.rows[0] * height)), int(round(self.rows[1] * height)),
+                int(round(left * width)), int(round(right * width)))
+
+    def crop(self, image):
+        y0, y1, x0, x1 = self.bounds(image.shape[1], image.shape[0])
+        return image[y0:y1, x0:x1]
+
+    def mask(self, width, height):
+        """uint8 mask (255 inside) with the shape of the cropped box, or None for a rectangle."""
+        key = (width, height)
+        if key in self._masks:
+            return self._masks[key]
+        mask = None
+        if self.top_cols != self.bottom_cols:
+            y0, y1, x0, x1 = self.bounds(width, height)
+            t = (np.arange(y0, y1, dtype=np.float32) + 0.5 - y0) / max(y1 - y0, 1)
+            left = (self.top_cols[0] + t * (self.bottom_cols[0] - self.top_cols[0])) * width
+            right = (self.top_cols[1] + t * (self.bottom_cols[1] - self.top_cols[1])) * width
+            columns = np.arange(x0, x1, dtype=np.float32) + 0.5
+            inside = (columns[None, :] >= left[:, None]) & (columns[None, :] < right[:, None])
+            mask = inside.astype(np.uint8) * 255
+        self._masks[key] = mask
+        return mask
+
+    def area_fraction(self, width=640, height=480):
+        """Share of the frame covered by the trapezoid."""
+        y0, y1, x0, x1 = self.bounds(width, height)
+        mask = self.mask(width, height)
+        pixels = (y1 - y0) * (x1 - x0) if mask is None else np.count_nonzero(mask)
+        return float(pixels) / (width * height)
+
+    def scale_threshold(self, threshold, width=640, height=480):
+        """A whole-frame pixel-count threshold scaled to the ROI area (not for segment counts)."""
+        return threshold * self.area_fraction(width, height)
+
+
+FULL_FRAME = RegionOfInterest()
+
+# Pasillo por el que camina el robot: suelo delante de los pies
+ROIS = {
+    TOP_CAMERA: FULL_FRAME,
+    BOTTOM_CAMERA: RegionOfInterest(rows=(0.4, 1.0), top_cols=(0.25, 0.75), bottom_cols=(0.0, 1.0)),
+}
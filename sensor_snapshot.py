@@ -0,0 +1,94 @@
+# -*- encoding: UTF-8 -*-
+"""Reads every sensor key a decision needs in a single ALMemory.getListData call."""
+
+import collections
+import time
+
+SONAR_LEFT = "Device/SubDeviceList/US/Left/Sensor/Value"
+SONAR_RIGHT = "Device/SubDeviceList/US/Right/Sensor/Value"
+ECHOES = 9
+LEFT_ECHOES = ["{}{}".format(SONAR_LEFT, i) for i in range(1, ECHOES + 1)]
+RIGHT_ECHOES = ["{}{}".format(SONAR_RIGHT, i) for i in range(1, ECHOES + 1)]
+LEFT_FOOT_BUMPERS = [
+    "Device/SubDeviceList/LFoot/Bumper/Left/Sensor/Value",
+    "Device/SubDeviceList/LFoot/Bumper/Right/Sensor/Value",
+]
+RIGHT_FOOT_BUMPERS = [
+    "Device/SubDeviceList/RFoot/Bumper/Left/Sensor/Value",
+    "Device/SubDeviceList/RFoot/Bumper/Right/Sensor/Value",
+]
+HEAD_YAW = "Device/SubDeviceList/HeadYaw/Position/Sensor/Value"
+HEAD_PITCH = "Device/SubDeviceList/HeadPitch/Position/Sensor/Value"
+
+SONAR_KEYS = [SONAR_LEFT, SONAR_RIGHT]
+HEAD_KEYS = [HEAD_YAW, HEAD_PITCH]
+
+SENSOR_KEYS = ([SONAR_LEFT, SONAR_RIGHT] + LEFT_ECHOES + RIGHT_ECHOES +
+               LEFT_FOOT_BUMPERS + RIGHT_FOOT_BUMPERS + [HEAD_YAW, HEAD_PITCH])
+
+SensorSnapshot = collections.namedtuple("SensorSnapshot", [
+    "time", "sonar_left", "sonar_right", "left_echoes", "right_echoes",
+    "left_bumper", "right_bumper", "head_yaw", "head_pitch",
+])
+
+
+def _number(value, default=float("nan")):
+    """float(value), or default for keys ALMemory has no value for."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def snapshot_from_values(values, timestamp=None):
+    """Builds a SensorSnapshot from values listed in SENSOR_KEYS order."""
+    numbers = [_number(value) for value in values]
+    echoes = 2 + ECHOES
+    bumpers = echoes + ECHOES
+    return SensorSnapshot(
+        time.time() if timestamp is None else timestamp,
+        numbers[0], numbers[1],
+        tuple(numbers[2:echoes]), tuple(numbers[echoes:bumpers]),
+        any(value > 0.5 for value in numbers[bumpers:bumpers + 2]),
+        any(value > 0.5 for value in numbers[bumpers + 2:bumpers + 4]),
+        _number(values[bumpers + 4], 0.0), _number(values[bumpers + 5], 0.0))
+
+
+class SensorReader(object):
+    """Fetches SENSOR_KEYS with one getListData round-trip per read().
+
+    sonars() and head() fetch only their two keys, for callers that need
+    nothing else.
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.reads = 0
+        self.keys_read = 0
+        self.total_time = 0.0
+
+    def _fetch(self, keys):
+        start = time.time()
+        values = self.memory.getListData(keys)
+        self.reads += 1
+        self.keys_read += len(keys)
+        self.total_time += time.time() - start
+        return values, start
+
+    def read(self):
+        values, start = self._fetch(SENSOR_KEYS)
+        return snapshot_from_values(values, start)
+
+    def sonars(self):
+        """(left, right) sonar distances; nan for a missing value."""
+        values, _ = self._fetch(SONAR_KEYS)
+        return _number(values[0]), _number(values[1])
+
+    def head(self):
+        """(yaw, pitch) of the head in radians."""
+        values, _ = self._fetch(HEAD_KEYS)
+        return _number(values[0], 0.0), _number(values[1], 0.0)
+
+    def format_stats(self):
+        return "Sensor reads: {} getListData calls, {:.1f} keys per call, {:.1f} ms per call".format(
+            self.reads, float(self.keys_read) / (self.reads or 1), self.total_time / (self.reads or 1) * 1000.0)
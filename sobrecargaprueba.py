@@ -2,6 +2,8 @@ import sys
 import time
 from naoqi import ALProxy, ALBroker, ALModule
 
+from sonar_events import SonarEventCoalescer, avoid_until_clear
+
 NAO_IP = "10.42.0.134"
 SonarHandler = None
 memory = None
@@ -26,20 +28,18 @@ class SonarHandlerModule(ALModule):
         self.right_turn_attempts = 0
         self.max_turn_attempts = 1
 
+        self.sonar_events = SonarEventCoalescer(self.on_sonar_transition, window=0.3,
+                                                safe_distance=self.safe_distance, memory=memory)
+        self.max_avoid_turns = 4
+        self.sonar_events.start()
         self.subscribe_to_events()
         self.start_moving_forward()
 
     def subscribe_to_events(self):
-        memory.subscribeToEvent("SonarLeftDetected", "SonarHandler", "onSonarLeftDetected")
-        memory.subscribeToEvent("SonarRightDetected", "SonarHandler", "onSonarRightDetected")
-        memory.subscribeToEvent("SonarLeftNothingDetected", "SonarHandler", "onSonarNothingDetected")
-        memory.subscribeToEvent("SonarRightNothingDetected", "SonarHandler", "onSonarNothingDetected")
-
-    def unsubscribe_from_events(self):
-        memory.unsubscribeToEvent("SonarLeftDetected", "SonarHandler")
-        memory.unsubscribeToEvent("SonarRightDetected", "SonarHandler")
-        memory.unsubscribeToEvent("SonarLeftNothingDetected", "SonarHandler")
-        memory.unsubscribeToEvent("SonarRightNothingDetected", "SonarHandler")
+        memory.subscribeToEvent("SonarLeftDetected", "SonarHandler", "onSonarEvent")
+        memory.subscribeToEvent("SonarRightDetected", "SonarHandler", "onSonarEvent")
+        memory.subscribeToEvent("SonarLeftNothingDetected", "SonarHandler", "onSonarEvent")
+        memory.subscribeToEvent("SonarRightNothingDetected", "SonarHandler", "onSonarEvent")
 
     def start_moving_forward(self):
         if not self.is_moving_forward and not self.motion.moveIsActive():
@@ -59,7 +59,6 @@ class SonarHandlerModule(ALModule):
         if self.motion.moveIsActive():
             self.motion.stopMove()
         print("Turning to the {}.".format(direction))
-        self.unsubscribe_from_events()
         self.motion.moveInit()
 
         if direction == 'left':
@@ -72,38 +71,26 @@ class SonarHandlerModule(ALModule):
         self.motion.waitUntilMoveIsFinished()
         time.sleep(0.5)
         self.is_turning = False
-        self.subscribe_to_events()
 
     def reset_turn_attempts(self):
         self.left_turn_attempts = 0
         self.right_turn_attempts = 0
 
-    def onSonarRightDetected(self, *_args):
-        print("RightSonarDetected")
-        distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
-        print("Right sonar detected an object at distance: {:.2f} m".format(distance))
-
-        if distance < self.safe_distance and not self.is_turning:
-            self.stop_moving_forward()
-            if self.right_turn_attempts < self.max_turn_attempts:
-                self.move_laterally('left')
-            else:
-                self.move_laterally('right')
-
-    def onSonarLeftDetected(self, *_args):
-        print("LeftSonarDetected")
-        distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
-        print("Left sonar detected an object at distance: {:.2f} m".format(distance))
-
-        if distance < self.safe_distance and not self.is_turning:
-            self.stop_moving_forward()
-            if self.left_turn_attempts < self.max_turn_attempts:
-                self.move_laterally('right')
-            else:
-                self.move_laterally('left')
-
-    def onSonarNothingDetected(self, *_args):
-        if not self.is_turning and not self.is_moving_forward:
+    def turn_direction(self, side):
+        if side == 'right':
+            return 'left' if self.right_turn_attempts < self.max_turn_attempts else 'right'
+        return 'right' if self.left_turn_attempts < self.max_turn_attempts else 'left'
+
+    def onSonarEvent(self, event, value, _subscriber):
+        self.sonar_events.push(event, value)
+
+    def on_sonar_transition(self, state):
+        avoid_until_clear(self.sonar_events, state, self.stop_moving_forward,
+                          lambda side: self.move_laterally(self.turn_direction(side)),
+                          self.resume_forward, self.max_avoid_turns)
+
+    def resume_forward(self):
+        if not self.is_moving_forward:
             print("No obstacles detected by sonar, resuming forward movement.")
             self.start_moving_forward()
             self.reset_turn_attempts()
@@ -119,6 +106,8 @@ def main():
 
     except KeyboardInterrupt:
         print("Keyboard Interruption")
+        SonarHandler.sonar_events.stop()
+        print(SonarHandler.sonar_events.format_stats())
         myBroker.shutdown()
         sys.exit(0)
 
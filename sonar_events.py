@@ -0,0 +1,202 @@
+# -*- encoding: UTF-8 -*-
+"""Coalesces bursts of ALSonar events into clear / blocked transitions."""
+
+import collections
+import threading
+import time
+
+from sensor_snapshot import SONAR_KEYS
+
+CLEAR = "clear"
+BLOCKED = "blocked"
+
+SONAR_EVENTS = {
+    "SonarLeftDetected": ("left", True),
+    "SonarRightDetected": ("right", True),
+    "SonarLeftNothingDetected": ("left", False),
+    "SonarRightNothingDetected": ("right", False),
+}
+
+SIDES = ("left", "right")
+
+# side es el lado bloqueado mas cercano (None si el camino esta libre)
+SonarState = collections.namedtuple("SonarState", ["state", "side", "distance", "time"])
+
+
+class SonarEventCoalescer(object):
+    """Collects sonar events from the handlers and delivers only state changes.
+
+    push() is all a NAOqi event handler should call: it records the newest
+    event per side and returns at once. A delivery thread waits window
+    seconds after the first event of a burst, so later events of the burst
+    supersede earlier ones, then calls callback(SonarState) only if the
+    overall state went clear -> blocked or blocked -> clear. A side is
+    blocked by a Detected event closer than safe_distance (or without a
+    distance) and stays blocked until a NothingDetected event for that
+    side arrives; a missing event is not a reading. With memory, a side
+    that got no event for max_age seconds is checked with one direct
+    getListData of the sonar keys, and only a distance above
+    safe_distance clears it. current() and the delivery thread apply the
+    same rule. The callback runs on the delivery thread, one at a time.
+    """
+
+    def __init__(self, callback, window=0.3, safe_distance=0.5, max_age=1.0, memory=None):
+        self.callback = callback
+        self.window = window
+        self.safe_distance = safe_distance
+        self.max_age = max_age
+        self.memory = memory
+        self._sides = {}
+        self._pending = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.delivered_state = CLEAR
+        self.started = None
+        self.raw_events = 0
+        self.superseded = 0
+        self.delivered = 0
+        self.confirmations = 0
+
+    def start(self):
+        if self._thread is None:
+            self.started = time.time()
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="SonarEventCoalescer")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def push(self, event, value=None):
+        """Records one ALSonar event; value is the distance it carried, if any."""
+        if event not in SONAR_EVENTS:
+            return
+        side, detected = SONAR_EVENTS[event]
+        number = isinstance(value, (int, float)) and not isinstance(value, bool)
+        distance = float(value) if number else None
+        blocked = detected and (distance is None or distance < self.safe_distance)
+        with self._condition:
+            self.raw_events += 1
+            if side in self._pending:
+                self.superseded += 1
+            self._sides[side] = (blocked, distance, time.time())
+            self._pending.add(side)
+            self._condition.notify()
+
+    def _confirm_stale(self):
+        """Re-reads the sonars for blocked sides that got no event for max_age seconds."""
+        if self.memory is None:
+            return
+        now = time.time()
+        with self._condition:
+            stale = dict((side, received) for side, (blocked, _, received) in self._sides.items()
+                         if blocked and now - received > self.max_age)
+        if not stale:
+            return
+        try:
+            readings = dict(zip(SIDES, self.memory.getListData(SONAR_KEYS)))
+        except Exception as e:
+            print("Error confirming sonar distances: {}".format(e))
+            return
+        self.confirmations += 1
+        received = time.time()
+        with self._condition:
+            for side, last in stale.items():
+                distance = readings[side]
+                if isinstance(distance, bool) or not isinstance(distance, (int, float)):
+                    continue
+                # un evento llegado mientras tanto es mas reciente que esta lectura
+                if self._sides[side][2] == last:
+                    self._sides[side] = (distance < self.safe_distance, float(distance), received)
+
+    def current(self):
+        """SonarState from the newest reading per side (blocked sides confirmed when stale)."""
+        self._confirm_stale()
+        now = time.time()
+        with self._condition:
+            sides = dict(self._sides)
+        nearest = None
+        for side, (blocked, distance, received) in sides.items():
+            if not blocked:
+                continue
+            if nearest is None or (distance or 0.0) < (nearest[1] or 0.0):
+                nearest = (side, distance, received)
+        if nearest is None:
+            return SonarState(CLEAR, None, None, now)
+        return SonarState(BLOCKED, nearest[0], nearest[1], nearest[2])
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._running and not self._pending:
+                    # sin eventos tambien se revisa, para confirmar bloqueos sin eventos recientes
+                    self._condition.wait(self.max_age / 2.0)
+                if not self._running:
+                    return
+                burst = bool(self._pending)
+            if burst:
+                # el resto de la rafaga llega mientras tanto y sustituye a lo anterior
+                time.sleep(self.window)
+                with self._condition:
+                    self._pending.clear()
+            state = self.current()
+            if state.state == self.delivered_state:
+                continue
+            self.delivered_state = state.state
+            self.delivered += 1
+            try:
+                self.callback(state)
+            except Exception as e:
+                print("Error handling sonar transition to {}: {}".format(state.state, e))
+
+    def stats(self):
+        elapsed = time.time() - self.started if self.started else 0.0
+        return {
+            "raw_events": self.raw_events,
+            "superseded": self.superseded,
+            "delivered": self.delivered,
+            "confirmations": self.confirmations,
+            "raw_rate": self.raw_events / elapsed if elapsed else 0.0,
+            "delivered_rate": self.delivered / elapsed if elapsed else 0.0,
+        }
+
+    def format_stats(self):
+        return ("Sonar events: {raw_events} raw ({raw_rate:.2f}/s), {superseded} superseded within a burst, "
+                "{delivered} transitions delivered ({delivered_rate:.2f}/s), "
+                "{confirmations} direct reads to confirm a block").format(**self.stats())
+
+
+def avoid_until_clear(coalescer, state, stop, turn, resume, max_turns=4):
+    """Reacts to a delivered SonarState for a SonarHandlerModule.
+
+    CLEAR calls resume(). BLOCKED calls stop(), then turn(side) away from
+    the blocked side until coalescer.current() is clear, at most max_turns
+    times, and resume() once it is. Still blocked after max_turns, the
+    robot stays stopped until the coalescer delivers CLEAR.
+    """
+    if state.state != BLOCKED:
+        resume()
+        return
+    print("{} sonar detected an object at distance: {}".format(state.side, state.distance))
+    stop()
+    side = state.side
+    turns = 0
+    while side is not None and turns < max_turns and coalescer.running:
+        turn(side)
+        turns += 1
+        side = coalescer.current().side
+    if side is None:
+        resume()
+    else:
+        print("Still blocked after {} turns, waiting for the path to clear.".format(turns))
@@ -0,0 +1,115 @@
+# -*- encoding: UTF-8 -*-
+"""Fuses every sonar echo (Value, Value1..Value9 per side) into a left/center/right profile.
+
+Crosstalk is one emitter's pulse heard by the other side's receiver: the
+same distance shows up on both sides in one ping. When that happens on
+the first echo of both sides it is an object straight ahead (both cones
+overlap there) and counts as center; any other cross-side match is
+treated as crosstalk and the copy that is not a first echo is dropped.
+"""
+
+import numpy as np
+
+from ground_plane import SideRanges
+from sensor_snapshot import SONAR_LEFT, SONAR_RIGHT, LEFT_ECHOES, RIGHT_ECHOES, ECHOES
+
+ECHO_KEYS = [SONAR_LEFT, SONAR_RIGHT] + LEFT_ECHOES + RIGHT_ECHOES
+
+# Rango util de los sonares del NAO (metros); 5.0 significa "sin eco"
+MIN_RANGE = 0.2
+MAX_RANGE = 5.0
+
+
+def echo_matrix(values):
+    """(2, 1 + ECHOES) array of left / right echoes from values in ECHO_KEYS order."""
+    numbers = np.array([v if isinstance(v, (int, float)) else np.nan for v in values], dtype=float)
+    left = np.concatenate((numbers[:1], numbers[2:2 + ECHOES]))
+    right = np.concatenate((numbers[1:2], numbers[2 + ECHOES:2 + 2 * ECHOES]))
+    return np.vstack((left, right))
+
+
+def _nearest(ranges):
+    return float(ranges.min()) if ranges.size else float("inf")
+
+
+class SonarFusion(object):
+    """Keeps the last pings of every echo and derives a SideRanges profile.
+
+    An echo is used only if it is inside the sonar range and a similar
+    echo (within tolerance) was seen on the same side in at least
+    min_support of the previous history pings, which drops single-ping
+    outliers; min_support=0 keeps every in-range echo. Echoes matching
+    across sides in the same ping are split into center and crosstalk as
+    described in the module docstring; with reject_crosstalk=False every
+    cross-side match counts as center. The profile is for choosing where
+    to turn: no echo is nearer than the first one, which the stop checks
+    already read.
+    """
+
+    def __init__(self, history=5, min_support=2, tolerance=0.05, reject_crosstalk=True):
+        self.history = np.full((history, 2, 1 + ECHOES), np.inf)
+        self.min_support = min_support
+        self.tolerance = tolerance
+        self.reject_crosstalk = reject_crosstalk
+        self.pings = 0
+        self.echoes = 0
+        self.out_of_range = 0
+        self.unsupported = 0
+        self.crosstalk = 0
+        self._profile = SideRanges(np.inf, np.inf, np.inf)
+
+    def update(self, values):
+        """Adds one ping (values in ECHO_KEYS order) and returns the new profile."""
+        echoes = echo_matrix(values)
+        in_range = (echoes >= MIN_RANGE) & (echoes < MAX_RANGE)
+        echoes = np.where(in_range, echoes, np.inf)
+
+        # apoyo: en cuantos pings anteriores hubo un eco parecido en el mismo lado
+        with np.errstate(invalid="ignore"):
+            close = np.abs(self.history[:, :, None, :] - echoes[None, :, :, None]) < self.tolerance
+        support = close.any(axis=3).sum(axis=0)
+        accepted = in_range & (support >= self.min_support)
+
+        self.history = np.roll(self.history, 1, axis=0)
+        self.history[0] = echoes
+        self.pings += 1
+        self.echoes += int(in_range.sum())
+        self.out_of_range += int(in_range.size - in_range.sum())
+        self.unsupported += int((in_range & ~accepted).sum())
+
+        left = np.where(accepted[0], echoes[0], np.inf)
+        right = np.where(accepted[1], echoes[1], np.inf)
+        with np.errstate(invalid="ignore"):
+            both = np.abs(left[:, None] - right[None, :]) < self.tolerance
+        if self.reject_crosstalk:
+            later = np.arange(1 + ECHOES) > 0
+            cross = both.copy()
+            cross[0, 0] = False
+            left_cross = cross.any(axis=1) & later
+            right_cross = cross.any(axis=0) & later
+            self.crosstalk += int(left_cross.sum() + right_cross.sum())
+            left = np.where(left_cross, np.inf, left)
+            right = np.where(right_cross, np.inf, right)
+            left_in_center = ~later & both[0, 0]
+            right_in_center = left_in_center
+        else:
+            left_in_center = both.any(axis=1)
+            right_in_center = both.any(axis=0)
+        self._profile = SideRanges(
+            _nearest(left[~left_in_center]),
+            min(_nearest(left[left_in_center]), _nearest(right[right_in_center])),
+            _nearest(right[~right_in_center]))
+        return self._profile
+
+    def profile(self):
+        """Latest SideRanges (inf where nothing was confirmed)."""
+        return self._profile
+
+    def read(self, memory):
+        """Fetches all echoes with one getListData call and updates the profile."""
+        return self.update(memory.getListData(ECHO_KEYS))
+
+    def format_stats(self):
+        return ("Sonar fusion: {} pings, {} echoes in range, {} rejected as outliers, {} as crosstalk, "
+                "profile {:.2f} / {:.2f} / {:.2f} m").format(
+                    self.pings, self.echoes, self.unsupported, self.crosstalk, *self._profile)
@@ -0,0 +1,154 @@
+# -*- encoding: UTF-8 -*-
+"""Background sonar sampling into a numpy ring with median / EMA filters."""
+
+import collections
+import threading
+import time
+
+import numpy as np
+
+from sensor_snapshot import SONAR_KEYS
+from sonar_fusion import ECHO_KEYS
+
+SonarSample = collections.namedtuple("SonarSample", ["time", "left", "right"])
+
+# Los sonares del NAO se actualizan cada 100 ms
+SONAR_PERIOD = 0.1
+
+
+class SonarSampler(object):
+    """Reads both sonars every period seconds with one getListData call.
+
+    Rows of the ring are (receive time, left, right). latest(), window()
+    and distances() only look at local memory, so avoidance code can ask
+    as often as it wants without any RPC. With a SonarFusion the same call
+    also fetches every echo and feeds it, so fusion.profile() stays current.
+
+    Stop decisions use current() (newest sample), turn selection uses
+    distances() (median of the window). Both read the two sonar keys
+    directly when the ring has nothing recent, so they never return None.
+    """
+
+    def __init__(self, memory, period=SONAR_PERIOD, capacity=600, fusion=None):
+        self.memory = memory
+        self.period = period
+        self.fusion = fusion
+        self._keys = ECHO_KEYS if fusion is not None else SONAR_KEYS
+        self.samples = np.zeros((capacity, 3))
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self.count = 0
+        self.errors = 0
+        self.direct_reads = 0
+        self.started = None
+
+    def start(self):
+        """Takes the first sample synchronously, then keeps sampling in a thread."""
+        if self._thread is None:
+            self.started = time.time()
+            self._sample()
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="SonarSampler")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def _sample(self):
+        try:
+            values = self.memory.getListData(self._keys)
+            row = (time.time(), float(values[0]), float(values[1]))
+            if self.fusion is not None:
+                self.fusion.update(values)
+        except Exception as e:
+            self.errors += 1
+            print("Error reading sonars: {}".format(e))
+            return
+        with self._lock:
+            self.samples[self.count % len(self.samples)] = row
+            self.count += 1
+
+    def _run(self):
+        next_time = time.time() + self.period
+        while self._running:
+            now = time.time()
+            if next_time > now:
+                time.sleep(next_time - now)
+                next_time += self.period
+            else:
+                # tras un parón se vuelve a sincronizar en vez de leer en rafaga
+                next_time = now + self.period
+            self._sample()
+
+    def latest(self):
+        """Newest raw SonarSample, or None before the first one."""
+        with self._lock:
+            if not self.count:
+                return None
+            row = self.samples[(self.count - 1) % len(self.samples)]
+            return SonarSample(float(row[0]), float(row[1]), float(row[2]))
+
+    def window(self, seconds):
+        """Copy of the samples of the last seconds, oldest first, as an (N, 3) array."""
+        with self._lock:
+            size = min(self.count, len(self.samples))
+            start = (self.count - size) % len(self.samples)
+            ordered = np.roll(self.samples, -start, axis=0)[:size]
+        return ordered[ordered[:, 0] >= time.time() - seconds]
+
+    def median(self, seconds=0.3):
+        """(left, right) median over the window, or None if it is empty."""
+        values = self.window(seconds)[:, 1:]
+        if not len(values):
+            return None
+        left, right = np.median(values, axis=0)
+        return float(left), float(right)
+
+    def ema(self, seconds=1.0, alpha=0.5):
+        """(left, right) exponential moving average over the window, newest weighted alpha."""
+        values = self.window(seconds)[:, 1:]
+        if not len(values):
+            return None
+        weights = (1.0 - alpha) ** np.arange(len(values) - 1, -1, -1)
+        left, right = weights.dot(values) / weights.sum()
+        return float(left), float(right)
+
+    def _read_direct(self):
+        values = self.memory.getListData(SONAR_KEYS)
+        self.direct_reads += 1
+        return float(values[0]), float(values[1])
+
+    def current(self, max_age=None):
+        """Newest (left, right) for stop decisions; read directly if older than max_age (2 periods)."""
+        max_age = 2 * self.period if max_age is None else max_age
+        sample = self.latest()
+        if sample is None or time.time() - sample.time > max_age:
+            return self._read_direct()
+        return sample.left, sample.right
+
+    def distances(self, seconds=0.3):
+        """Median (left, right) over the window for turn selection; read directly if it is empty."""
+        filtered = self.median(seconds)
+        if filtered is None:
+            return self._read_direct()
+        return filtered
+
+    def stats(self):
+        elapsed = time.time() - self.started if self.started else 0.0
+        sample = self.latest()
+        return {
+            "samples": self.count,
+            "errors": self.errors,
+            "direct_reads": self.direct_reads,
+            "rate_hz": self.count / elapsed if elapsed else 0.0,
+            "age_ms": (time.time() - sample.time) * 1000.0 if sample else 0.0,
+        }
+
+    def format_stats(self):
+        return ("Sonar sampler: {samples} samples at {rate_hz:.1f} Hz, {errors} errors, "
+                "{direct_reads} direct reads, newest {age_ms:.0f} ms old").format(**self.stats())
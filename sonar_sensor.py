@@ -6,6 +6,9 @@
 import qi
 import argparse
 import sys
+import time
+
+from sonar_fusion import SonarFusion
 
 
 def main(session):
@@ -28,6 +31,15 @@ def main(session):
     # Same thing for right.
     memory_service.getData("Device/SubDeviceList/US/Right/Sensor/Value")
 
+    # Every echo of both sonars (Value, Value1..Value9) in one getListData
+    # call, fused into a left / center / right profile. An echo has to
+    # repeat over a few pings before it is trusted.
+    fusion = SonarFusion()
+    for _ in range(3):
+        profile = fusion.read(memory_service)
+        time.sleep(0.1)
+    print("Left / center / right: {:.2f} / {:.2f} / {:.2f} m".format(*profile))
+
     # # Unsubscribe from sonars, this will stop sonars (at hardware level)
     # sonar_service.unsubscribe("myApplication")
 
@@ -1,6 +1,9 @@
 # -*- encoding: UTF-8 -*-
 from naoqi import ALProxy
+import math
 import time
+from sonar_fusion import SonarFusion
+from sonar_sampler import SonarSampler
 
 def sonar_test(nao_ip, nao_port):
     # Crear un proxy para el módulo ALSonar
@@ -11,21 +14,28 @@ def sonar_test(nao_ip, nao_port):
     
     # Activar los sensores de sonar
     sonarProxy.subscribe("SonarApp")
+    # Los sonares se muestrean a su frecuencia de actualización en segundo plano
+    sampler = SonarSampler(memoryProxy, fusion=SonarFusion())
+    sampler.start()
 
     print("Sonar activated. Reading values...")
     
     try:
         while(1):
         # for i in range(10):  # Leer datos durante un tiempo limitado
-            # Leer la distancia detectada por el sonar izquierdo
-            left_distance = memoryProxy.getData("Device/SubDeviceList/US/Left/Sensor/Value")
-            # Leer la distancia detectada por el sonar derecho
-            right_distance = memoryProxy.getData("Device/SubDeviceList/US/Right/Sensor/Value")
+            # Distancias filtradas del último segundo, sin llamadas a ALMemory
+            sample = sampler.latest()
+            median = sampler.median(1.0)
+            ema = sampler.ema(1.0)
             
-            # Comprobamos que los datos no sean None y que sean números
-            if isinstance(left_distance, (int, float)) and isinstance(right_distance, (int, float)):
-                print("Left Sonar Distance: {:.2f} m".format(left_distance))
-                print("Right Sonar Distance: {:.2f} m".format(right_distance))
+            # Las claves sin valor llegan como nan
+            if median is not None and not math.isnan(sample.left) and not math.isnan(sample.right):
+                print("Left Sonar Distance: {:.2f} m (median {:.2f}, EMA {:.2f})".format(
+                    sample.left, median[0], ema[0]))
+                print("Right Sonar Distance: {:.2f} m (median {:.2f}, EMA {:.2f})".format(
+                    sample.right, median[1], ema[1]))
+                print("Echoes left / center / right: {:.2f} / {:.2f} / {:.2f} m".format(
+                    *sampler.fusion.profile()))
             else:
                 print("Error: Invalid data received from sonar sensors.")
             
@@ -35,8 +45,11 @@ def sonar_test(nao_ip, nao_port):
         print("Test interrupted by user.")
     
     # Desactivar los sensores de sonar cuando se termine el test
+    sampler.stop()
     sonarProxy.unsubscribe("SonarApp")
     print("Sonar deactivated.")
+    print(sampler.format_stats())
+    print(sampler.fusion.format_stats())
 
 def main():
     nao_ip = "10.42.0.134"  # Cambia a la IP de tu robot
@@ -1,20 +1,28 @@
 import sys
 import time
-import cv2
-import numpy as np
 from naoqi import ALProxy, ALBroker, ALModule
+from camera_session import DualCameraSession, kYuvColorSpace
+from frame_grabber import FrameGrabber
+from resolution_controller import ResolutionController, USE_CASES
+from change_gate import ChangeGate
+from image_writer import AsyncImageWriter, DROP_OLDEST
+from artifact_cache import artifact_cache
+from free_space import freest_side, turn_angle, describe
+from ground_plane import SideRanges, fuse_with_sonar, nearest_sides
+from sensor_snapshot import SensorReader
+from sonar_fusion import SonarFusion
+from sonar_sampler import SonarSampler
+from vision_workers import VisionWorkerPool, run_vision_job
 
 NAO_IP = "localhost"
 SonarHandler = None
 memory = None
+sensors = None
 cameraProxy = None
+vision_pool = None
 
-def detect_edges(image):
-    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred_image = cv2.GaussianBlur(gray_image, (5, 5), 0)
-    edges = cv2.Canny(blurred_image, 50, 150)
-    edge_count = cv2.countNonZero(edges)
-    return edges, edge_count
+# Los mapas de bordes se escriben en segundo plano
+image_writer = AsyncImageWriter(max_queue=4, drop_policy=DROP_OLDEST, fmt="jpeg", jpeg_quality=80)
 
 class SonarHandlerModule(ALModule):
     def __init__(self, name):
@@ -24,11 +32,25 @@ class SonarHandlerModule(ALModule):
             self.motion = ALProxy("ALMotion")
             global memory
             memory = ALProxy("ALMemory")
+            global sensors
+            sensors = SensorReader(memory)
             global cameraProxy
             cameraProxy = ALProxy("ALVideoDevice")
+            fast_resolution, fast_fps = USE_CASES["walking"]
+            full_resolution, full_fps = USE_CASES["full"]
+            self.cameras = DualCameraSession(cameraProxy, "SonarHandlerCameras", fast_resolution, kYuvColorSpace, fast_fps)
+            self.full_cameras = DualCameraSession(cameraProxy, "SonarHandlerCamerasFull", full_resolution, kYuvColorSpace, full_fps)
+            self.grabber = FrameGrabber(self.cameras)
+            self.grabber.start()
+            self.change_gate = ChangeGate()
+            self.camera_check = ResolutionController(self.grabber, self.full_cameras, gate=self.change_gate,
+                                                     pool=vision_pool, adaptive=True, keep_edges=True)
 
             sonarProxy = ALProxy("ALSonar")
             sonarProxy.subscribe("SonarApp")
+            # Los sonares se leen en segundo plano; parar con la última muestra, girar con la mediana
+            self.sonar = SonarSampler(memory, fusion=SonarFusion())
+            self.sonar.start()
             print("Sonar and camera activated. Reading values...")
 
             self.safe_distance = 0.5
@@ -80,16 +102,16 @@ class SonarHandlerModule(ALModule):
         except Exception as e:
             print("Error stopping forward movement: {}".format(e))
 
-    def move_laterally(self):
+    def move_laterally(self, angle=0.6):
         try:
             print("Turning to the {}.".format(self.turning_direction))
             self.motion.moveInit()
             self.is_turning = True
 
             if self.turning_direction == 'left':
-                self.motion.moveTo(0, 0, 0.6)  
+                self.motion.moveTo(0, 0, angle)
             elif self.turning_direction == 'right':
-                self.motion.moveTo(0, 0, -0.6)  
+                self.motion.moveTo(0, 0, -angle)
 
             self.motion.waitUntilMoveIsFinished()
             time.sleep(1)  
@@ -100,7 +122,7 @@ class SonarHandlerModule(ALModule):
     def onSonarRightDetected(self, *_args):
         print("Obstacle detected by right sonar.")
         try:
-            distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
+            distance = self.sonar.current()[1]
             print("Right sonar detected an object at distance: {}".format(distance))
             if distance < self.safe_distance:
                 self.stop_moving_forward()
@@ -112,7 +134,7 @@ class SonarHandlerModule(ALModule):
     def onSonarLeftDetected(self, *_args):
         print("Obstacle detected by left sonar.")
         try:
-            distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
+            distance = self.sonar.current()[0]
             print("Left sonar detected an object at distance: {}".format(distance))
             if distance < self.safe_distance:
                 self.stop_moving_forward()
@@ -121,10 +143,45 @@ class SonarHandlerModule(ALModule):
         except Exception as e:
             print("Error handling left sonar detection: {}".format(e))
 
+    def choose_turn(self):
+        """Points turning_direction at the freest side and returns the angle.
+
+        The side with the farther fused camera + sonar range wins; when both
+        are within 10 cm the bottom-camera sector clutter decides.
+        """
+        try:
+            frame = self.grabber.latest()
+            if frame is None:
+                return 0.6
+            head_yaw, head_pitch = sensors.head()
+            result = run_vision_job(vision_pool, frame.image[1], "edge_check", "bottom", frame.timestamp,
+                                    adaptive_canny=True, head_yaw=head_yaw, head_pitch=head_pitch)
+            if result is None:
+                # frame sin decidir: se gira hacia el lado que eligió el sonar
+                return 0.6
+            scores = result["sectors"]
+            print("Sectores de la cámara inferior: {}".format(describe(scores)))
+
+            sides = fuse_with_sonar(SideRanges(*result["sides"]), *self.sonar.distances())
+            sides = nearest_sides(sides, self.sonar.fusion.profile())
+            print("Distancias cámara+sonar: izquierda {:.2f} m, centro {:.2f} m, derecha {:.2f} m".format(
+                sides.left, sides.center, sides.right))
+
+            if abs(sides.left - sides.right) > 0.1:
+                self.turning_direction = 'left' if sides.left > sides.right else 'right'
+            else:
+                self.turning_direction = freest_side(scores)
+            return abs(turn_angle(scores, self.turning_direction))
+        except Exception as e:
+            print("Error estimating free space: {}".format(e))
+            return 0.6
+
     def avoid_obstacle(self):
+        angle = self.choose_turn()
         while not self.is_clear_path():
             print("Turning to find a clear path...")
-            self.move_laterally()
+            self.move_laterally(angle)
+            angle = 0.6
             time.sleep(0.5)
         print("Path is clear. Resuming forward movement.")
         self.motion.stopMove()
@@ -135,47 +192,52 @@ class SonarHandlerModule(ALModule):
 
     def process_image(self):
         try:
-            resolution = 2  
-            colorSpace = 13  
-            fps = 30
-
-           
-            client_top = cameraProxy.subscribeCamera("TopCamera", 0, resolution, colorSpace, fps)
-            client_bottom = cameraProxy.subscribeCamera("BottomCamera", 1, resolution, colorSpace, fps)
-
-           
-            top_result = cameraProxy.getImageRemote(client_top)
-            if top_result[0] is not None:
-                top_image = np.frombuffer(bytearray(top_result[6]), np.uint8).reshape((top_result[1], top_result[0], 3))
-                edges_top, edge_count_top = detect_edges(top_image)
-                print("Cámara superior: Bordes detectados = {}".format(edge_count_top))
-                cv2.imwrite("edges_top.jpg", edges_top) 
-
-           
-            bottom_result = cameraProxy.getImageRemote(client_bottom)
-            if bottom_result[0] is not None:
-                bottom_image = np.frombuffer(bytearray(bottom_result[6]), np.uint8).reshape((bottom_result[1], bottom_result[0], 3))
-                edges_bottom, edge_count_bottom = detect_edges(bottom_image)
-                print("Cámara inferior: Bordes detectados = {}".format(edge_count_bottom))
-                cv2.imwrite("edges_bottom.jpg", edges_bottom) 
-
-          
-            camera_clear_top = edge_count_top <= 1000
-            camera_clear_bottom = edge_count_bottom <= 1000
-
-           
-            cameraProxy.unsubscribe(client_top)
-            cameraProxy.unsubscribe(client_bottom)
-
-            return camera_clear_top and camera_clear_bottom
+            check = self.camera_check.check()
+            if check is None:
+                # sin ninguna decisión todavía: el camino cuenta como bloqueado
+                return False
+
+            edge_count_top, edge_count_bottom = check.scores
+            print("Cámara superior: Bordes detectados = {:.0f}".format(edge_count_top))
+            print("Cámara inferior: Bordes detectados = {:.0f}".format(edge_count_bottom))
+            if check.edges is not None:
+                edges_top, edges_bottom = check.edges
+                image_writer.save("edges_top.jpg", edges_top)
+                image_writer.save("edges_bottom.jpg", edges_bottom)
+            if check.escalated:
+                print("Chequeo ambiguo, repetido a resolución completa.")
+
+            return check.clear
         except Exception as e:
             print("Error procesando imagen: {}".format(e))
             return False
 
+    def close_cameras(self):
+        self.grabber.stop()
+        print(self.grabber.format_stats())
+        print(self.camera_check.format_stats())
+        print(self.change_gate.format_stats())
+        if vision_pool is None:
+            # con procesos de visión la caché de este proceso no se usa
+            print(artifact_cache.format_stats())
+        print(self.cameras.format_stats())
+        print(self.full_cameras.format_stats())
+        self.cameras.close()
+        self.full_cameras.close()
+        image_writer.stop()
+        print(image_writer.format_stats())
+        print(sensors.format_stats())
+        self.sonar.stop()
+        print(self.sonar.format_stats())
+        print(self.sonar.fusion.format_stats())
+        if vision_pool is not None:
+            vision_pool.close()
+            print(vision_pool.format_stats())
+
     def is_clear_path(self):
         try:
-            right_distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
-            left_distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
+            left_distance, right_distance = self.sonar.current()
+            echoes = self.sonar.fusion.profile()
             camera_clear = self.process_image()
 
             path_clear = (
@@ -184,8 +246,8 @@ class SonarHandlerModule(ALModule):
                 and camera_clear
             )
 
-            print("Right distance: {}, Left distance: {}, Cámara despejada: {}".format(
-                right_distance, left_distance, camera_clear))
+            print("Right distance: {}, Left distance: {}, Ecos I/C/D: {:.2f}/{:.2f}/{:.2f}, Cámara despejada: {}".format(
+                right_distance, left_distance, echoes.left, echoes.center, echoes.right, camera_clear))
             print("Estado de camino despejado: {}".format(path_clear))
             return path_clear
         except Exception as e:
@@ -195,6 +257,9 @@ class SonarHandlerModule(ALModule):
 
 def main():
     try:
+        # Los procesos de visión se crean antes del broker de NAOqi
+        global vision_pool
+        vision_pool = VisionWorkerPool()
         myBroker = ALBroker("myBroker", "0.0.0.0", 0, NAO_IP, 9559)
         global SonarHandler
         SonarHandler = SonarHandlerModule("SonarHandler")
@@ -205,6 +270,7 @@ def main():
         print("Keyboard Interruption")
         if SonarHandler:
             SonarHandler.stop_moving_forward()
+            SonarHandler.close_cameras()
         sys.exit(0)
     except Exception as e:
         print("Error in main: {}".format(e))
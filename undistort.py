@@ -0,0 +1,128 @@
+# -*- encoding: UTF-8 -*-
+"""Lens undistortion with remap tables cached in memory and on disk.
+
+initUndistortRectifyMap is computed once per camera and resolution and
+saved under MAP_CACHE_DIR, so later runs (and the vision worker processes)
+only load it. Each frame then costs a single remap into a pooled buffer.
+
+The distortion coefficients come from a per-robot calibration file
+(CALIBRATION_FILE, or the NAO_CALIBRATION environment variable), a JSON
+object mapping the camera index to its (k1, k2, p1, p2, k3), e.g.
+{"1": [-0.07, 0.09, 0.0, 0.0, -0.02]}. A camera without an entry is not
+calibrated and is never undistorted.
+"""
+
+import hashlib
+import json
+import math
+import os
+
+import cv2
+import numpy as np
+
+from frame_decoder import default_decoder
+from ground_plane import CAMERA_HFOV, CAMERA_VFOV
+
+MAP_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nao_undistort")
+CALIBRATION_FILE = os.environ.get(
+    "NAO_CALIBRATION", os.path.join(os.path.expanduser("~"), ".config", "nao_camera_calibration.json"))
+
+_distortion = {}
+
+
+def load_distortion(path=CALIBRATION_FILE):
+    """{camera: (k1, k2, p1, p2, k3)} from the calibration file; empty if there is none."""
+    if path not in _distortion:
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+            _distortion[path] = dict((int(camera), tuple(float(k) for k in coefficients))
+                                     for camera, coefficients in entries.items())
+        except (IOError, OSError):
+            _distortion[path] = {}
+        except ValueError as e:
+            print("Error leyendo la calibracion {}: {}".format(path, e))
+            _distortion[path] = {}
+    return _distortion[path]
+
+
+def calibrated(camera, path=CALIBRATION_FILE):
+    return camera in load_distortion(path)
+
+
+def camera_matrix(width, height):
+    """Pinhole intrinsics from the nominal field of view, principal point at the centre."""
+    fx = (width / 2.0) / math.tan(CAMERA_HFOV / 2.0)
+    fy = (height / 2.0) / math.tan(CAMERA_VFOV / 2.0)
+    return np.array([[fx, 0.0, width / 2.0],
+                     [0.0, fy, height / 2.0],
+                     [0.0, 0.0, 1.0]])
+
+
+def _cache_path(camera, width, height, coefficients, directory):
+    digest = hashlib.md5(repr(tuple(coefficients)).encode("ascii")).hexdigest()[:8]
+    return os.path.join(directory, "cam{}_{}x{}_{}.npz".format(camera, width, height, digest))
+
+
+def _compute_maps(width, height, coefficients):
+    matrix = camera_matrix(width, height)
+    return cv2.initUndistortRectifyMap(matrix, np.array(coefficients), None, matrix,
+                                       (width, height), cv2.CV_16SC2)
+
+
+def _save_maps(path, map1, map2):
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    # escritura atomica: los procesos de vision pueden crear el mismo fichero
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        np.savez(f, map1=map1, map2=map2)
+    os.rename(tmp_path, path)
+
+
+_maps = {}
+
+
+def undistort_maps(camera, width, height, directory=MAP_CACHE_DIR):
+    """(map1, map2) for cv2.remap, from memory, the disk cache or computed."""
+    distortion = load_distortion()
+    if camera not in distortion:
+        raise ValueError("No calibration for camera {} in {}".format(camera, CALIBRATION_FILE))
+    coefficients = distortion[camera]
+    key = (camera, width, height, coefficients)
+    maps = _maps.get(key)
+    if maps is not None:
+        return maps
+    path = _cache_path(camera, width, height, coefficients, directory)
+    try:
+        with np.load(path) as data:
+            maps = (data["map1"], data["map2"])
+    except (IOError, OSError, KeyError, ValueError):
+        maps = _compute_maps(width, height, coefficients)
+        try:
+            _save_maps(path, *maps)
+        except (IOError, OSError) as e:
+            print("Error guardando mapas de distorsion: {}".format(e))
+    _maps[key] = maps
+    return maps
+
+
+def undistort(gray, camera, tag="frame", decoder=default_decoder, roi=None):
+    """Undistorted copy of a gray image in a pooled buffer (valid until the next frame of tag).
+
+    With a RegionOfInterest only its bounding box is remapped, using the
+    matching slice of the full-frame maps.
+    """
+    if not gray.flags.c_contiguous:
+        gray = np.ascontiguousarray(gray)
+    height, width = gray.shape[:2]
+    map1, map2 = undistort_maps(camera, width, height)
+    if roi is not None:
+        map1 = roi.crop(map1)
+        map2 = roi.crop(map2)
+    out = decoder.pool.get((tag, "undistorted"), map2.shape)
+    return cv2.remap(gray, map1, map2, cv2.INTER_LINEAR, dst=out)
@@ -0,0 +1,51 @@
+# -*- encoding: UTF-8 -*-
+"""Obstacle checks shared by the sonar + camera scripts.
+
+When artifacts (a FrameArtifacts from artifact_cache) is given, the gray,
+blurred, edge and Hough results are taken from and stored in that frame's
+cache entry, so other detectors looking at the same frame reuse them.
+thresholds is the (low, high) Canny pair, e.g. from adaptive_canny.
+"""
+
+import cv2
+import numpy as np
+
+from adaptive_canny import DEFAULT_THRESHOLDS
+from frame_decoder import default_decoder
+
+
+def pyramid_level(image, level, tag="frame", decoder=default_decoder):
+    """Gray image downscaled by 2 ** level (INTER_AREA) into a pooled buffer."""
+    gray = decoder.gray(image, tag)
+    if level == 0:
+        return gray
+    height, width = gray.shape[:2]
+    out = decoder.pool.get((tag, "pyramid", level), (height >> level, width >> level))
+    return cv2.resize(gray, (width >> level, height >> level), dst=out, interpolation=cv2.INTER_AREA)
+
+
+def detect_edges(image, tag="frame", decoder=default_decoder, artifacts=None,
+                 thresholds=DEFAULT_THRESHOLDS):
+    low, high = thresholds
+    if artifacts is not None:
+        edges = artifacts.edges(low, high)
+    else:
+        gray_image = decoder.gray(image, tag)
+        blurred_image = decoder.blur(gray_image, tag)
+        edges = decoder.edges(blurred_image, tag, low, high)
+    edge_count = cv2.countNonZero(edges)
+    return edges, edge_count
+
+
+def detect_lines(image, tag="frame", threshold=50, min_line_length=0, max_line_gap=0,
+                 decoder=default_decoder, artifacts=None, thresholds=DEFAULT_THRESHOLDS):
+    """Canny + HoughLinesP on the raw gray image, as process_image did."""
+    low, high = thresholds
+    if artifacts is not None:
+        return (artifacts.edges(low, high, blur=False),
+                artifacts.lines(threshold, min_line_length, max_line_gap, low, high))
+    gray_image = decoder.gray(image, tag)
+    edges = decoder.edges(gray_image, tag, low, high)
+    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=threshold,
+                            minLineLength=min_line_length, maxLineGap=max_line_gap)
+    return edges, lines
@@ -0,0 +1,271 @@
+# -*- encoding: UTF-8 -*-
+"""Declarative obstacle-check pipelines with per-stage timing and allocations.
+
+A Pipeline is a list of stages (capture, convert, ROI, blur, edges, lines,
+decide) that pass a state dict along. Every stage is timed, and the
+buffers it takes from the pipeline's BufferPool plus any array it has to
+allocate itself are counted, so two variants can be compared on the same
+recorded input:
+
+    edge = edge_count_pipeline()
+    hough = hough_pipeline(min_line_length=50, max_line_gap=10)
+    state = hough.run(image, timestamp)
+    print(hough.format_stats())
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+from camera_session import container_timestamp
+from frame_decoder import BufferPool, FrameDecoder, decode
+from resolution_controller import VGA_EDGE_THRESHOLD, normalized_edge_count
+from undistort import undistort
+
+
+class NoFrame(Exception):
+    """Raised by Capture when the session returned no image."""
+
+
+class StageStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.allocations = 0
+        self.allocated_bytes = 0
+
+    def record(self, elapsed, allocations, allocated_bytes):
+        self.frames += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.allocations += allocations
+        self.allocated_bytes += allocated_bytes
+
+    def as_dict(self):
+        frames = self.frames or 1
+        return {
+            "stage": self.name,
+            "frames": self.frames,
+            "mean_ms": self.total_time / frames * 1000.0,
+            "max_ms": self.max_time * 1000.0,
+            "allocations": self.allocations,
+            "allocations_per_frame": float(self.allocations) / frames,
+            "allocated_kb": self.allocated_bytes / 1024.0,
+        }
+
+
+class Stage(object):
+    """One step of a pipeline.
+
+    Every stage defines run(state, decoder), which reads and writes entries
+    of state. It returns None, or the number of arrays it allocated outside
+    decoder.pool together with their size in bytes, as (count, nbytes).
+    """
+    name = "stage"
+
+
+class Capture(Stage):
+    """Fetches the next frame from a CameraSession and wraps it without copying.
+
+    The layout comes from the container, so recordings made in any color
+    space can be replayed.
+    """
+    name = "capture"
+
+    def __init__(self, session):
+        self.session = session
+
+    def run(self, state, decoder):
+        container = self.session.get_image()
+        if container is None:
+            raise NoFrame()
+        state["image"] = decode(container)
+        state["timestamp"] = container_timestamp(container)
+
+
+class Convert(Stage):
+    """Gray image: the Y plane of YUV frames, cvtColor of BGR ones."""
+    name = "convert"
+
+    def run(self, state, decoder):
+        state["gray"] = decoder.gray(state["image"], state["tag"])
+
+
+class Undistort(Stage):
+    """Remaps the gray image through the cached undistortion maps of camera."""
+    name = "undistort"
+
+    def __init__(self, camera):
+        self.camera = camera
+
+    def run(self, state, decoder):
+        state["gray"] = undistort(state["gray"], self.camera, state["tag"], decoder)
+
+
+class Roi(Stage):
+    """Crops the gray image to the bounding box of a RegionOfInterest, as a view.
+
+    Edges masks what falls outside the trapezoid, and the edge-count
+    decision scales its threshold by roi_fraction. The line-count limit
+    is not scaled, since segment counts do not shrink with the area.
+    """
+    name = "roi"
+
+    def __init__(self, roi):
+        self.roi = roi
+
+    def run(self, state, decoder):
+        gray = state["gray"]
+        height, width = gray.shape[:2]
+        state["gray"] = self.roi.crop(gray)
+        state["roi_mask"] = self.roi.mask(width, height)
+        state["roi_fraction"] = self.roi.area_fraction(width, height)
+
+
+class Blur(Stage):
+    name = "blur"
+
+    def __init__(self, ksize=(5, 5)):
+        self.ksize = ksize
+
+    def run(self, state, decoder):
+        state["blurred"] = decoder.blur(state["gray"], state["tag"], self.ksize)
+
+
+class Edges(Stage):
+    """Canny on the blurred image if there is one, else on the gray image."""
+    name = "edges"
+
+    def __init__(self, low=50, high=150):
+        self.low = low
+        self.high = high
+
+    def run(self, state, decoder):
+        source = state.get("blurred")
+        if source is None:
+            source = state["gray"]
+        edges = decoder.edges(source, state["tag"], self.low, self.high)
+        mask = state.get("roi_mask")
+        if mask is not None:
+            cv2.bitwise_and(edges, mask, dst=edges)
+        state["edges"] = edges
+        state["edge_count"] = cv2.countNonZero(edges)
+
+
+class Lines(Stage):
+    name = "lines"
+
+    def __init__(self, threshold=50, min_line_length=0, max_line_gap=0):
+        self.threshold = threshold
+        self.min_line_length = min_line_length
+        self.max_line_gap = max_line_gap
+
+    def run(self, state, decoder):
+        lines = cv2.HoughLinesP(state["edges"], 1, np.pi / 180, threshold=self.threshold,
+                                minLineLength=self.min_line_length, maxLineGap=self.max_line_gap)
+        state["lines"] = lines
+        if lines is not None:
+            return 1, lines.nbytes
+
+
+class EdgeCountDecision(Stage):
+    """Clear when the VGA-equivalent edge count is at most threshold (trescin.py)."""
+    name = "decide"
+
+    def __init__(self, threshold=VGA_EDGE_THRESHOLD):
+        self.threshold = threshold
+
+    def run(self, state, decoder):
+        state["score"] = normalized_edge_count(state["edge_count"], state["image"].shape[1])
+        state["clear"] = state["score"] <= self.threshold * state.get("roi_fraction", 1.0)
+
+
+class LineCountDecision(Stage):
+    """Clear when HoughLinesP found at most max_lines segments (bottom.py)."""
+    name = "decide"
+
+    def __init__(self, max_lines=4):
+        self.max_lines = max_lines
+
+    def run(self, state, decoder):
+        state["score"] = 0 if state["lines"] is None else len(state["lines"])
+        state["clear"] = state["score"] <= self.max_lines
+
+
+class Pipeline(object):
+    """Runs stages in order and keeps a StageStats per stage.
+
+    Each pipeline owns a FrameDecoder with its own BufferPool unless one is
+    given, so allocation counts are not mixed between variants.
+    """
+
+    def __init__(self, name, stages, decoder=None):
+        self.name = name
+        self.stages = list(stages)
+        self.decoder = decoder if decoder is not None else FrameDecoder(BufferPool())
+        self._stats = [StageStats(stage.name) for stage in self.stages]
+        self.frames = 0
+
+    def run(self, image=None, timestamp=0.0, tag=None):
+        """Returns the final state dict, or None if Capture had no frame."""
+        state = {"image": image, "timestamp": timestamp, "tag": tag or self.name}
+        pool = self.decoder.pool
+        for stage, stats in zip(self.stages, self._stats):
+            allocations = pool.allocations
+            allocated_bytes = pool.allocated_bytes
+            start = time.time()
+            try:
+                fresh = stage.run(state, self.decoder)
+            except NoFrame:
+                return None
+            elapsed = time.time() - start
+            allocations = pool.allocations - allocations
+            allocated_bytes = pool.allocated_bytes - allocated_bytes
+            if fresh is not None:
+                allocations += fresh[0]
+                allocated_bytes += fresh[1]
+            stats.record(elapsed, allocations, allocated_bytes)
+        self.frames += 1
+        return state
+
+    def reset_stats(self):
+        self._stats = [StageStats(stage.name) for stage in self.stages]
+        self.frames = 0
+
+    def stats(self):
+        return [stats.as_dict() for stats in self._stats]
+
+    def format_stats(self):
+        lines = ["Pipeline {}: {} frames".format(self.name, self.frames)]
+        total = 0.0
+        for row in self.stats():
+            total += row["mean_ms"]
+            lines.append("  {stage:<10} {mean_ms:7.2f} ms/frame (max {max_ms:6.2f}), "
+                         "{allocations_per_frame:.2f} allocs/frame, {allocated_kb:.0f} KB total".format(**row))
+        lines.append("  {:<10} {:7.2f} ms/frame".format("total", total))
+        return "\n".join(lines)
+
+
+def edge_count_pipeline(session=None, threshold=VGA_EDGE_THRESHOLD, roi=None, name="edge_count"):
+    """GaussianBlur + Canny + edge count, the trescin.py check."""
+    stages = [Capture(session)] if session is not None else []
+    stages.append(Convert())
+    if roi is not None:
+        stages.append(Roi(roi))
+    return Pipeline(name, stages + [Blur(), Edges(), EdgeCountDecision(threshold)])
+
+
+def hough_pipeline(session=None, threshold=50, min_line_length=0, max_line_gap=0,
+                   max_lines=4, undistort_camera=None, roi=None, name="hough"):
+    """Canny + HoughLinesP + line count, the bottom.py check."""
+    stages = [Capture(session)] if session is not None else []
+    stages.append(Convert())
+    if undistort_camera is not None:
+        stages.append(Undistort(undistort_camera))
+    if roi is not None:
+        stages.append(Roi(roi))
+    return Pipeline(name, stages + [Edges(), Lines(threshold, min_line_length, max_line_gap),
+                                    LineCountDecision(max_lines)])
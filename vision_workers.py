@@ -0,0 +1,266 @@
+# -*- encoding: UTF-8 -*-
+"""Vision jobs run in worker processes, fed through shared-memory frame slots.
+
+The NAOqi callback thread only copies the frame into a free slot and waits
+on a small result, so Canny and Hough never hold its GIL. Create the pool
+before the ALBroker so the workers are forked from a single-threaded
+process.
+"""
+
+import itertools
+import multiprocessing
+import threading
+
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from adaptive_canny import DEFAULT_THRESHOLDS, adaptive_canny
+from artifact_cache import artifact_cache
+from frame_decoder import default_decoder
+from free_space import sector_scores
+from ground_plane import ground_plane, range_profile, side_ranges
+from roi import ROIS
+from undistort import undistort
+from vision_checks import detect_edges, detect_lines, pyramid_level
+
+MAX_FRAME_BYTES = 640 * 480 * 3
+
+
+def _canny_thresholds(artifacts, params):
+    if params.get("adaptive_canny"):
+        return adaptive_canny.thresholds(artifacts.gray())
+    return DEFAULT_THRESHOLDS
+
+
+def edge_check_job(image, tag, timestamp, params):
+    """detect_edges count, sector clutter and camera side ranges of one frame.
+
+    With params["return_edges"] the edge map itself is returned too, for
+    callers that save it; otherwise only the small results cross back.
+    """
+    artifacts = artifact_cache.get(image, tag, timestamp)
+    edges, edge_count = detect_edges(image, tag, artifacts=artifacts,
+                                     thresholds=_canny_thresholds(artifacts, params))
+    table = ground_plane(edges.shape[1], edges.shape[0],
+                         params.get("head_yaw", 0.0), params.get("head_pitch", 0.0))
+    sides = side_ranges(range_profile(edges, table), table)
+    result = {
+        "edge_count": edge_count,
+        "width": edges.shape[1],
+        "sectors": [float(s) for s in sector_scores(edges)],
+        "sides": tuple(sides),
+    }
+    if params.get("return_edges"):
+        result["edges"] = edges.copy()
+    return result
+
+
+def hough_job(image, tag, timestamp, params):
+    """Canny + HoughLinesP line count and sector clutter of one frame.
+
+    params["level"] runs the check on that pyramid level of the frame
+    (downscaled here, in the worker).
+
+    With params["undistort"] set to a camera index, the gray image is
+    undistorted first so straight edges near the borders stay one segment.
+    params["roi"] names the camera whose ROIS entry the check is cropped
+    to; the sector scores then use every row of the crop, which is already
+    the floor band. roi_fraction is the share of the frame it covers, for
+    scaling whole-frame pixel-count thresholds. params["adaptive_canny"] picks the Canny
+    thresholds from the frame's brightness (both jobs).
+    """
+    level = params.get("level", 0)
+    if level:
+        image = pyramid_level(image, level, tag)
+        tag = "{}-level{}".format(tag, level)
+    height, width = image.shape[:2]
+    roi = ROIS[params["roi"]] if params.get("roi") is not None else None
+    camera = params.get("undistort")
+    if camera is not None:
+        image = undistort(default_decoder.gray(image, tag), camera, tag, roi=roi)
+        tag = "{}-undistorted".format(tag)
+    elif roi is not None:
+        image = roi.crop(image)
+    mask = None
+    roi_fraction = 1.0
+    if roi is not None:
+        mask = roi.mask(width, height)
+        roi_fraction = roi.area_fraction(width, height)
+        tag = "{}-roi".format(tag)
+    artifacts = artifact_cache.get(image, tag, timestamp, mask)
+    edges, lines = detect_lines(image, tag, params.get("threshold", 50),
+                                params.get("min_line_length", 0), params.get("max_line_gap", 0),
+                                artifacts=artifacts, thresholds=_canny_thresholds(artifacts, params))
+    band = (0.0, 1.0) if roi is not None else (0.4, 1.0)
+    return {
+        "lines": 0 if lines is None else len(lines),
+        "sectors": [float(s) for s in sector_scores(edges, band=band)],
+        "roi_fraction": roi_fraction,
+    }
+
+
+JOBS = {
+    "edge_check": edge_check_job,
+    "hough": hough_job,
+}
+
+
+def _worker_main(buffers, tasks, results):
+    views = [np.frombuffer(buf, dtype=np.uint8) for buf in buffers]
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, slot, shape, job, tag, timestamp, params = task
+        image = views[slot][:int(np.prod(shape))].reshape(shape)
+        try:
+            results.put((task_id, slot, JOBS[job](image, tag, timestamp, params), None))
+        except Exception as e:
+            results.put((task_id, slot, None, "{}: {}".format(type(e).__name__, e)))
+
+
+class VisionTask(object):
+    """Handle for a submitted job; result() waits for the worker's answer."""
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _finish(self, result, error):
+        self._result = result
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError("Vision task {} timed out".format(self.task_id))
+        if self._error is not None:
+            raise RuntimeError("Vision task {} failed: {}".format(self.task_id, self._error))
+        return self._result
+
+
+class VisionWorkerPool(object):
+    """Worker processes sharing a fixed set of frame slots with the caller.
+
+    submit() never blocks: if every slot is busy the frame is dropped and
+    None is returned. wait() returns None when the worker does not answer
+    in time or the job failed.
+
+    Policy for those frames, shared by every script: a None result means
+    the frame is undecided. The check keeps its previous decision (see
+    ResolutionController and CoarseToFineCheck), and with no previous
+    decision the path counts as blocked. The job is never run inline on
+    the callback thread instead.
+    """
+
+    def __init__(self, workers=None, slots=None, max_frame_bytes=MAX_FRAME_BYTES):
+        if workers is None:
+            workers = max(1, multiprocessing.cpu_count() - 1)
+        if slots is None:
+            slots = 2 * workers
+        self.max_frame_bytes = max_frame_bytes
+        self._buffers = [multiprocessing.RawArray("B", max_frame_bytes) for _ in range(slots)]
+        self._views = [np.frombuffer(buf, dtype=np.uint8) for buf in self._buffers]
+        self._free = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.timeouts = 0
+        self.failures = 0
+        self._processes = []
+        for index in range(workers):
+            process = multiprocessing.Process(target=_worker_main, name="VisionWorker-{}".format(index),
+                                              args=(self._buffers, self._tasks, self._results))
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+        self._collector = threading.Thread(target=self._collect, name="VisionWorkerResults")
+        self._collector.daemon = True
+        self._collector.start()
+
+    def _collect(self):
+        while True:
+            message = self._results.get()
+            if message is None:
+                break
+            task_id, slot, result, error = message
+            self._free.put(slot)
+            with self._lock:
+                task = self._pending.pop(task_id, None)
+                self.completed += 1
+            if task is not None:
+                task._finish(result, error)
+
+    def submit(self, image, job, tag="frame", timestamp=0.0, **params):
+        """Copies image into a free slot and queues job on it, or returns None."""
+        if image.nbytes > self.max_frame_bytes:
+            raise ValueError("Frame of {} bytes does not fit in a {} byte slot".format(
+                image.nbytes, self.max_frame_bytes))
+        try:
+            slot = self._free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return None
+        np.copyto(self._views[slot][:image.size].reshape(image.shape), image)
+        task = VisionTask(next(self._ids))
+        with self._lock:
+            self._pending[task.task_id] = task
+            self.submitted += 1
+        self._tasks.put((task.task_id, slot, image.shape, job, tag, timestamp, params))
+        return task
+
+    def wait(self, task, timeout=1.0):
+        """task's result, or None if it was dropped, timed out or failed."""
+        if task is None:
+            return None
+        if not task._done.wait(timeout):
+            self.timeouts += 1
+            return None
+        if task._error is not None:
+            self.failures += 1
+            print("Error in vision task {}: {}".format(task.task_id, task._error))
+            return None
+        return task._result
+
+    def run(self, image, job, tag="frame", timestamp=0.0, timeout=1.0, **params):
+        """submit() and wait(); returns None if the frame was undecided."""
+        return self.wait(self.submit(image, job, tag, timestamp, **params), timeout)
+
+    def close(self):
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(2.0)
+        self._results.put(None)
+        self._collector.join(2.0)
+
+    def format_stats(self):
+        return ("Vision workers: {} processes, {} submitted, {} completed, {} dropped (no free slot), "
+                "{} timed out, {} failed").format(len(self._processes), self.submitted, self.completed,
+                                                  self.dropped, self.timeouts, self.failures)
+
+
+def run_vision_job(pool, image, job, tag="frame", timestamp=0.0, timeout=1.0, **params):
+    """Runs job on pool, or in this process when pool is None.
+
+    Returns None if the frame was undecided (dropped, timed out or failed).
+    """
+    if pool is None:
+        return JOBS[job](image, tag, timestamp, params)
+    return pool.run(image, job, tag, timestamp, timeout, **params)
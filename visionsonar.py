@@ -1,13 +1,20 @@
 import sys
 import time
-import cv2
-import numpy as np 
 from naoqi import ALProxy, ALBroker, ALModule
+from camera_session import CameraSession, BOTTOM_CAMERA, kVGA, kYuvColorSpace
+from frame_grabber import FrameGrabber
+from free_space import freest_side, describe
+from sonar_fusion import SonarFusion
+from sonar_sampler import SonarSampler
+from vision_workers import VisionWorkerPool
+from coarse_to_fine import CoarseToFineCheck
+from undistort import calibrated
 
 NAO_IP = "localhost"
 SonarHandler = None
 memory = None
 cameraProxy = None
+vision_pool = None
 
 class SonarHandlerModule(ALModule):
     def __init__(self, name):
@@ -18,12 +25,26 @@ class SonarHandlerModule(ALModule):
         memory = ALProxy("ALMemory")
         global cameraProxy
         cameraProxy = ALProxy("ALVideoDevice")
+        self.camera = CameraSession(cameraProxy, "SonarHandlerBottom", BOTTOM_CAMERA, kVGA, kYuvColorSpace, 5)
+        self.grabber = FrameGrabber(self.camera)
+        self.grabber.start()
 
         sonarProxy = ALProxy("ALSonar")
         sonarProxy.subscribe("SonarApp")
+        # Los sonares se leen en segundo plano; parar con la última muestra, girar con la mediana
+        self.sonar = SonarSampler(memory, fusion=SonarFusion())
+        self.sonar.start()
         print("Sonar and camera activated. Reading values...")
 
         self.safe_distance = 0.5
+        self.sector_scores = None
+        # Hough a 1/4 de resolución; VGA solo cerca del límite.
+        # Sin corregir la distorsión hasta que haya calibración del robot
+        undistort_camera = BOTTOM_CAMERA if calibrated(BOTTOM_CAMERA) else None
+        self.hough_check = CoarseToFineCheck(max_lines=4, level=2, pool=vision_pool, threshold=50,
+                                             min_line_length=50, max_line_gap=10,
+                                             undistort=undistort_camera, roi=BOTTOM_CAMERA,
+                                             adaptive_canny=True)
         self.is_moving_forward = False
         self.is_turning = False
 
@@ -83,7 +104,7 @@ class SonarHandlerModule(ALModule):
 
     def onSonarRightDetected(self, *_args):
         print("RightSonarDetected")
-        distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
+        distance = self.sonar.current()[1]
         print("Right sonar detected an object at distance: {}".format(distance))
 
         if distance < self.safe_distance and not self.is_turning:
@@ -100,7 +121,7 @@ class SonarHandlerModule(ALModule):
 
     def onSonarLeftDetected(self, *_args):
         print("LeftSonarDetected")
-        distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
+        distance = self.sonar.current()[0]
         print("Left sonar detected an object at distance: {}".format(distance))
 
         if distance < self.safe_distance and not self.is_turning:
@@ -132,39 +153,35 @@ class SonarHandlerModule(ALModule):
 
     def process_image(self):
         
-        resolution = 2 
-        colorSpace = 13  
-        video = cameraProxy.getImageRemote(cameraProxy.subscribe("CameraBottom", resolution, colorSpace, 5))
+        frame = self.grabber.latest()
 
-        if video is None:
+        if frame is None:
             return
 
-        
-        image = np.frombuffer(video[6], dtype=np.uint8)
-        image = image.reshape((video[1], video[0], 3))
-
-       
-        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-       
-        edges = cv2.Canny(gray_image, 50, 150)
-
-       
-        lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=50, minLineLength=50, maxLineGap=10)
+        check = self.hough_check.check(frame.image, "bottom", frame.timestamp)
+        if check is None:
+            # sin ninguna decisión todavía: el camino cuenta como bloqueado
+            print("No camera decision yet. Treating the path as blocked.")
+            self.stop_moving_forward()
+            return
+        self.sector_scores = check.sectors
 
-        if lines is not None and len(lines) > 4:  
-            print("Detected {} lines. Obstacle detected.".format(len(lines)))
+        if not check.clear:  
+            print("Detected {} lines. Obstacle detected.".format(check.lines))
             self.stop_moving_forward()
 
     def is_clear_path(self):
        
-        right_distance = memory.getData("Device/SubDeviceList/US/Right/Sensor/Value")
-        left_distance = memory.getData("Device/SubDeviceList/US/Left/Sensor/Value")
+        left_distance, right_distance = self.sonar.current()
         return right_distance > self.safe_distance and left_distance > self.safe_distance
 
     def turn_around(self):
         print("Turning around...")
-        self.move_laterally('left')
+        direction = 'left'
+        if self.sector_scores is not None:
+            print("Camera sectors: {}".format(describe(self.sector_scores)))
+            direction = freest_side(self.sector_scores)
+        self.move_laterally(direction)
         time.sleep(0.5)
         self.process_image()
         self.start_moving_forward()
@@ -172,6 +189,9 @@ class SonarHandlerModule(ALModule):
         self.resume_sonar_events() 
 
 def main():
+    # Los procesos de visión se crean antes del broker de NAOqi
+    global vision_pool
+    vision_pool = VisionWorkerPool()
     myBroker = ALBroker("myBroker", "0.0.0.0", 0, NAO_IP, 9559)
     global SonarHandler
     SonarHandler = SonarHandlerModule("SonarHandler")
@@ -183,6 +203,16 @@ def main():
     except KeyboardInterrupt:
         print("Keyboard Interruption")
         SonarHandler.stop_moving_forward()
+        SonarHandler.grabber.stop()
+        print(SonarHandler.grabber.format_stats())
+        print(SonarHandler.camera.format_stats())
+        print(SonarHandler.hough_check.format_stats())
+        SonarHandler.sonar.stop()
+        print(SonarHandler.sonar.format_stats())
+        print(SonarHandler.sonar.fusion.format_stats())
+        SonarHandler.camera.close()
+        vision_pool.close()
+        print(vision_pool.format_stats())
         myBroker.shutdown()
         sys.exit(0)
 